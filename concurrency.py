@@ -0,0 +1,155 @@
+"""
+Модуль адаптивного ограничения числа одновременных загрузок
+
+Лимит подбирается по схеме AIMD: после каждого окна завершённых загрузок
+он растёт на 1, если скорость выросла, а задержка ответа осталась близкой
+к лучшей; при 429/5xx/таймаутах лимит сразу уменьшается вдвое. Так быстрый
+канал используется полностью, а медленный или перегруженный сервер не
+получает лишних запросов.
+"""
+
+import time
+import asyncio
+from typing import List, Optional
+
+import config
+
+
+# Во сколько раз задержка ответа может превысить лучшую, не мешая росту
+LATENCY_TOLERANCE = 2.0
+
+# На сколько должна вырасти скорость за окно, чтобы увеличить лимит
+THROUGHPUT_GAIN = 1.05
+
+# Минимальный размер окна (завершённых загрузок)
+MIN_WINDOW = 4
+
+
+class AdaptiveLimiter:
+    """
+    Асинхронный ограничитель с изменяемым лимитом
+
+    Используется как asyncio.Semaphore: `async with limiter: ...`.
+    Результаты запросов сообщаются через record_success и record_overload.
+    Лимит сохраняется между вызовами, история изменений - в events.
+    """
+
+    def __init__(self, initial: int = None, minimum: int = None, maximum: int = None,
+                 adaptive: bool = None):
+        """
+        Args:
+            initial: Начальный лимит (None = config.MAX_CONCURRENT_DOWNLOADS)
+            minimum: Нижний предел (None = config.ADAPTIVE_MIN_CONCURRENT)
+            maximum: Верхний предел (None = config.ADAPTIVE_MAX_CONCURRENT)
+            adaptive: Менять лимит по ходу работы (None = config.ADAPTIVE_CONCURRENCY)
+        """
+        self.adaptive = config.ADAPTIVE_CONCURRENCY if adaptive is None else adaptive
+        initial = max(1, initial or config.MAX_CONCURRENT_DOWNLOADS)
+        if self.adaptive:
+            self.minimum = max(1, minimum or config.ADAPTIVE_MIN_CONCURRENT)
+            self.maximum = max(self.minimum, maximum or config.ADAPTIVE_MAX_CONCURRENT)
+        else:
+            self.minimum = self.maximum = initial
+        self.limit = min(self.maximum, max(self.minimum, initial))
+        self.peak = self.limit
+        self.in_flight = 0
+        # Изменения лимита с причинами: "5 -> 6: скорость растёт (1.20 МБ/с)"
+        self.events: List[str] = []
+
+        self._condition: Optional[asyncio.Condition] = None
+        self._loop = None
+        self._finished = 0
+        self._cooldown_until = 0
+        self._prev_throughput = 0.0
+        self._best_latency: Optional[float] = None
+        self._reset_window()
+
+    def _reset_window(self):
+        self._window_start = time.monotonic()
+        self._window_done = 0
+        self._window_bytes = 0
+        self._window_latency = 0.0
+        # Окно считается только если лимит действительно был заполнен
+        self._window_saturated = self.in_flight >= self.limit
+
+    def _get_condition(self) -> asyncio.Condition:
+        """Условие ожидания для текущего event loop"""
+        loop = asyncio.get_running_loop()
+        if self._condition is None or self._loop is not loop:
+            self._condition = asyncio.Condition()
+            self._loop = loop
+        return self._condition
+
+    async def __aenter__(self):
+        condition = self._get_condition()
+        async with condition:
+            if self.in_flight >= self.limit:
+                self._window_saturated = True
+            await condition.wait_for(lambda: self.in_flight < self.limit)
+            self.in_flight += 1
+            if self.in_flight >= self.limit:
+                self._window_saturated = True
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        condition = self._get_condition()
+        async with condition:
+            self.in_flight -= 1
+            condition.notify_all()
+
+    def _set_limit(self, limit: int, reason: str):
+        """Изменить лимит и запомнить причину"""
+        limit = min(self.maximum, max(self.minimum, limit))
+        if limit == self.limit:
+            return
+        self.events.append(f"{self.limit} -> {limit}: {reason}")
+        self.limit = limit
+        self.peak = max(self.peak, limit)
+        # Ожидающие загрузки проверят новый лимит при следующем release
+
+    def record_success(self, size: int, latency: float):
+        """
+        Учесть успешную загрузку
+
+        Args:
+            size: Сколько байт получено
+            latency: Время до получения заголовков ответа (в секундах)
+        """
+        self._finished += 1
+        if not self.adaptive:
+            return
+
+        self._window_done += 1
+        self._window_bytes += size
+        self._window_latency += latency
+        if self._window_done < max(MIN_WINDOW, self.limit):
+            return
+
+        elapsed = max(time.monotonic() - self._window_start, 1e-6)
+        throughput = self._window_bytes / elapsed
+        latency = self._window_latency / self._window_done
+        if self._best_latency is None or latency < self._best_latency:
+            self._best_latency = latency
+
+        if latency > self._best_latency * LATENCY_TOLERANCE:
+            self._set_limit(self.limit - 1, f"задержка выросла ({latency:.2f} с)")
+        elif self._window_saturated and throughput >= self._prev_throughput * THROUGHPUT_GAIN:
+            self._set_limit(self.limit + 1, f"скорость растёт ({throughput / 1024 / 1024:.2f} МБ/с)")
+
+        self._prev_throughput = throughput
+        self._reset_window()
+
+    def record_overload(self, reason: str):
+        """
+        Учесть признак перегрузки (429, 5xx, таймаут)
+
+        Лимит уменьшается вдвое не чаще одного раза за окно запросов:
+        ошибки запросов, начатых до уменьшения, повторно его не снижают.
+        """
+        self._finished += 1
+        if not self.adaptive or self._finished <= self._cooldown_until:
+            return
+        self._set_limit(self.limit // 2, reason)
+        self._cooldown_until = self._finished + max(MIN_WINDOW, self.limit)
+        self._prev_throughput = 0.0
+        self._reset_window()
@@ -8,21 +8,113 @@ ARHIVACH_DOMAIN = "https://arhivach.vc"
 # Папка для сохранения загруженных тредов
 OUTPUT_DIR = "downloads"
 
-# Максимальное количество одновременных загрузок медиа-файлов (1-30)
+# Общее хранилище медиа: каждый файл качается один раз и попадает
+# в папки тредов жёсткой ссылкой. Нужна файловая система с жёсткими
+# ссылками, иначе файлы в хранилище не добавляются (True/False)
+MEDIA_STORE_ENABLED = True
+
+# Папка общего хранилища медиа (None = OUTPUT_DIR/.media_store)
+MEDIA_STORE_DIR = None
+
+# Папка общего кеша CSS/JS (None = OUTPUT_DIR/.resources)
+RESOURCE_CACHE_DIR = None
+
+# Вести базу состояния загрузки: повторный запуск по тегу пропускает
+# загруженные треды и докачивает прерванные (True/False)
+CRAWL_STATE_ENABLED = True
+
+# Файл базы состояния (None = OUTPUT_DIR/.crawl_state.sqlite3)
+STATE_DB = None
+
+# Режим --sync для тегов: обход страниц прекращается, когда подряд
+# встречается столько уже загруженных тредов
+SYNC_STOP_AFTER_KNOWN = 10
+
+# Условные запросы (ETag/Last-Modified) к уже загруженным страницам:
+# неизменившийся тред не скачивается и не разбирается заново (True/False)
+CONDITIONAL_REQUESTS = True
+
+# Папка валидаторов страниц (None = OUTPUT_DIR/.pages)
+PAGE_CACHE_DIR = None
+
+# Кеш результатов разбора: страница, пришедшая байт в байт такой же,
+# не разбирается заново (True/False)
+PARSE_CACHE_ENABLED = True
+
+# Папка кеша разбора (None = OUTPUT_DIR/.parse_cache)
+PARSE_CACHE_DIR = None
+
+# Максимальное количество одновременных загрузок медиа-файлов (1-30).
+# При ADAPTIVE_CONCURRENCY - начальное значение
 MAX_CONCURRENT_DOWNLOADS = 5
 
+# Подбирать число одновременных загрузок медиа по ходу работы (AIMD):
+# +1, пока растёт скорость и не растут задержки, вдвое меньше при
+# 429/5xx/таймаутах (True/False)
+ADAPTIVE_CONCURRENCY = True
+
+# Пределы адаптивного числа одновременных загрузок
+ADAPTIVE_MIN_CONCURRENT = 1
+ADAPTIVE_MAX_CONCURRENT = 30
+
 # Таймаут для HTTP-запросов (в секундах)
 REQUEST_TIMEOUT = 30
 
+# Время жизни кеша DNS для пула соединений загрузчика медиа (в секундах)
+DNS_CACHE_TTL = 300
+
+# Сколько держать открытым неиспользуемое keep-alive соединение (в секундах)
+KEEPALIVE_TIMEOUT = 30
+
 # Задержка между запросами страниц (в секундах)
+# Задаёт среднюю частоту запросов HTML: не чаще 1 / PAGE_REQUEST_DELAY в секунду
 PAGE_REQUEST_DELAY = 1.0
 
+# Сколько запросов страниц можно сделать подряд без ожидания
+PAGE_REQUEST_BURST = 3
+
+# Хосты, с которых загружаются медиа-файлы (отдельный бюджет запросов)
+MEDIA_HOSTS = ('i.arhivach.vc',)
+
+# Частота запросов медиа-файлов (запросов в секунду, 0 = без ограничения)
+MEDIA_REQUESTS_PER_SECOND = 20.0
+
+# Сколько запросов медиа можно сделать подряд без ожидания
+MEDIA_REQUEST_BURST = 30
+
+# Максимальное количество одновременных запросов страниц (тег, треды)
+MAX_CONCURRENT_PAGES = 3
+
+# Сколько распарсенных тредов может ждать загрузки медиа в конвейере
+PIPELINE_QUEUE_SIZE = 2
+
+# Бэкенд разбора тредов: 'bs4' (BeautifulSoup поверх lxml) или 'lxml'
+# (lxml.html напрямую, быстрее; HTML отличается только форматированием).
+# Страницы тегов всегда разбираются через lxml
+PARSER_BACKEND = 'bs4'
+
+# Процессов для разбора тредов при загрузке по тегу (0 = разбор в потоках
+# основного процесса). Имеет смысл на многоядерных машинах вместе
+# с MAX_CONCURRENT_PAGES не меньше числа процессов
+PARSE_WORKERS = 0
+
 # Конвертировать изображения в JPG для экономии места (True/False)
 CONVERT_IMAGES_TO_JPG = True
 
 # Качество JPG при конвертации (1-100)
 JPG_QUALITY = 85
 
+# Процессов для конвертации в JPG (0 = конвертация в потоках, как раньше).
+# Конвертация идёт после освобождения слота загрузки
+CONVERT_WORKERS = 2
+
+# Сколько загруженных изображений может одновременно ждать и проходить
+# конвертацию; при переполнении новые загрузки приостанавливаются
+CONVERT_QUEUE_SIZE = 16
+
+# Размер блока при потоковой записи медиа на диск (в байтах)
+DOWNLOAD_CHUNK_SIZE = 256 * 1024
+
 # Количество повторных попыток загрузки при ошибке (1-30)
 DOWNLOAD_RETRIES = 5
 
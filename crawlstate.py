@@ -0,0 +1,332 @@
+"""
+Модуль состояния загрузки
+
+Локальная база SQLite хранит, какие треды и медиа-файлы уже загружены.
+Повторный запуск по тегу пропускает полностью загруженные треды без
+единого HTTP-запроса, а прерванные треды докачивает с места остановки.
+
+В той же базе хранятся посты всех загруженных тредов, поэтому выборки
+вида «все посты тега X с даты Y» не требуют повторного разбора HTML.
+"""
+
+import os
+import json
+import sqlite3
+import threading
+from contextlib import nullcontext
+from datetime import datetime
+from typing import ContextManager, Dict, Iterable, List, Optional, Set
+
+import config
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS threads (
+    thread_id   TEXT PRIMARY KEY,
+    url         TEXT NOT NULL,
+    folder      TEXT NOT NULL DEFAULT '',
+    posts_count INTEGER NOT NULL DEFAULT 0,
+    media_total INTEGER NOT NULL DEFAULT 0,
+    status      TEXT NOT NULL DEFAULT 'started',
+    updated_at  TEXT NOT NULL DEFAULT '',
+    tag_id      TEXT NOT NULL DEFAULT ''
+);
+
+CREATE TABLE IF NOT EXISTS media (
+    thread_id  TEXT NOT NULL,
+    url        TEXT NOT NULL,
+    filename   TEXT NOT NULL,
+    hash       TEXT NOT NULL DEFAULT '',
+    size       INTEGER NOT NULL DEFAULT 0,
+    status     TEXT NOT NULL,
+    updated_at TEXT NOT NULL DEFAULT '',
+    PRIMARY KEY (thread_id, url)
+);
+
+CREATE INDEX IF NOT EXISTS media_hash ON media (hash);
+
+CREATE TABLE IF NOT EXISTS posts (
+    thread_id   TEXT NOT NULL,
+    position    INTEGER NOT NULL,
+    number      TEXT NOT NULL DEFAULT '',
+    posted_at   TEXT NOT NULL DEFAULT '',
+    time        TEXT NOT NULL DEFAULT '',
+    subject     TEXT NOT NULL DEFAULT '',
+    text        TEXT NOT NULL DEFAULT '',
+    attachments TEXT NOT NULL DEFAULT '[]',
+    PRIMARY KEY (thread_id, position)
+);
+
+CREATE INDEX IF NOT EXISTS posts_posted_at ON posts (posted_at);
+"""
+
+# Колонки, добавленные после первой версии схемы: (таблица, колонка, определение)
+MIGRATIONS = [
+    ('threads', 'tag_id', "TEXT NOT NULL DEFAULT ''"),
+]
+
+# Индексы по колонкам из MIGRATIONS (создаются после миграции)
+POST_MIGRATION_SCHEMA = """
+CREATE INDEX IF NOT EXISTS threads_tag ON threads (tag_id);
+"""
+
+# Статусы треда
+THREAD_STARTED = 'started'
+THREAD_PARTIAL = 'partial'
+THREAD_COMPLETE = 'complete'
+
+# Статусы медиа-файла
+MEDIA_DONE = 'done'
+MEDIA_FAILED = 'failed'
+
+
+def _now() -> str:
+    return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+
+class CrawlState:
+    """
+    База состояния загрузки
+
+    Соединение используется из нескольких потоков конвейера,
+    поэтому все обращения идут под блокировкой.
+
+    Пример:
+        with CrawlState() as state:
+            if not state.is_thread_complete(thread_id):
+                ...
+    """
+
+    def __init__(self, db_path: str = None):
+        self.db_path = db_path or config.STATE_DB or os.path.join(config.OUTPUT_DIR, '.crawl_state.sqlite3')
+        os.makedirs(os.path.dirname(self.db_path) or '.', exist_ok=True)
+        self.conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock:
+            # WAL: запись результата по каждому файлу не должна тормозить загрузку
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+            self.conn.executescript(SCHEMA)
+            self._migrate()
+            self.conn.executescript(POST_MIGRATION_SCHEMA)
+            self.conn.commit()
+    
+    def _migrate(self):
+        """Добавить недостающие колонки в базу старой версии (вызывается под блокировкой)"""
+        for table, column, definition in MIGRATIONS:
+            columns = {row[1] for row in self.conn.execute(f"PRAGMA table_info({table})")}
+            if column not in columns:
+                self.conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        """Закрыть базу"""
+        if self.conn is not None:
+            with self.lock:
+                self.conn.close()
+                self.conn = None
+
+    def _execute(self, sql: str, params: tuple = ()):
+        """Выполнить запрос на изменение и зафиксировать его"""
+        with self.lock:
+            self.conn.execute(sql, params)
+            self.conn.commit()
+
+    def _query(self, sql: str, params: tuple = ()) -> list:
+        """Выполнить запрос на чтение"""
+        with self.lock:
+            cursor = self.conn.execute(sql, params)
+            cursor.row_factory = sqlite3.Row
+            return cursor.fetchall()
+
+    def get_thread(self, thread_id: str) -> Optional[sqlite3.Row]:
+        """Получить запись о треде"""
+        rows = self._query(
+            "SELECT thread_id, url, folder, posts_count, media_total, status, updated_at, tag_id "
+            "FROM threads WHERE thread_id = ?", (thread_id,)
+        )
+        return rows[0] if rows else None
+
+    def is_thread_complete(self, thread_id: str, posts_count: Optional[int] = None) -> bool:
+        """
+        Проверить, загружен ли тред полностью
+
+        Args:
+            thread_id: ID треда
+            posts_count: Количество постов по данным списка тредов
+                (None = не проверять, достаточно статуса). 0 означает, что
+                количество неизвестно: такой тред не считается загруженным,
+                иначе его новые посты никогда не были бы загружены
+        """
+        if not thread_id:
+            return False
+        row = self.get_thread(thread_id)
+        if row is None or row['status'] != THREAD_COMPLETE:
+            return False
+        if posts_count is None:
+            return True
+        return 0 < posts_count <= row['posts_count']
+
+    def start_thread(self, thread_id: str, url: str, folder: str, posts_count: int, media_total: int,
+                     tag_id: str = ''):
+        """
+        Отметить начало загрузки треда (HTML сохранён, медиа качаются)
+        
+        Args:
+            tag_id: Тег, по которому загружен тред ('' = не менять)
+        """
+        self._execute(
+            "INSERT INTO threads (thread_id, url, folder, posts_count, media_total, status, updated_at, tag_id) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT(thread_id) DO UPDATE SET url = excluded.url, folder = excluded.folder, "
+            "posts_count = excluded.posts_count, media_total = excluded.media_total, "
+            "status = excluded.status, updated_at = excluded.updated_at, "
+            "tag_id = CASE WHEN excluded.tag_id != '' THEN excluded.tag_id ELSE threads.tag_id END",
+            (thread_id, url, folder, posts_count, media_total, THREAD_STARTED, _now(), str(tag_id or ''))
+        )
+
+    def finish_thread(self, thread_id: str, complete: bool):
+        """Отметить окончание загрузки треда"""
+        status = THREAD_COMPLETE if complete else THREAD_PARTIAL
+        self._execute(
+            "UPDATE threads SET status = ?, updated_at = ? WHERE thread_id = ?",
+            (status, _now(), thread_id)
+        )
+
+    def record_media(self, url: str, thread_id: str, filename: str, size: int, status: str):
+        """Записать результат загрузки медиа-файла"""
+        file_hash = filename.split('.', 1)[0]
+        self._execute(
+            "INSERT INTO media (thread_id, url, filename, hash, size, status, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT(thread_id, url) DO UPDATE SET filename = excluded.filename, "
+            "size = excluded.size, status = excluded.status, updated_at = excluded.updated_at",
+            (thread_id, url, filename, file_hash, size, status, _now())
+        )
+
+    def update_media_size(self, thread_id: str, filename: str, size: int):
+        """Обновить размер загруженного файла (например, после конвертации)"""
+        self._execute(
+            "UPDATE media SET size = ?, updated_at = ? WHERE thread_id = ? AND filename = ?",
+            (size, _now(), thread_id, filename)
+        )
+
+    def done_media_urls(self, thread_id: str) -> Set[str]:
+        """Получить URL медиа-файлов треда, которые уже загружены"""
+        rows = self._query(
+            "SELECT url FROM media WHERE thread_id = ? AND status = ?",
+            (thread_id, MEDIA_DONE)
+        )
+        return {row['url'] for row in rows}
+
+    def media_sizes(self, thread_id: str) -> Dict[str, int]:
+        """
+        Получить размеры загруженных медиа-файлов треда
+
+        Returns:
+            URL -> размер файла на диске (файлы с неизвестным размером не включаются)
+        """
+        rows = self._query(
+            "SELECT url, size FROM media WHERE thread_id = ? AND status = ? AND size > 0",
+            (thread_id, MEDIA_DONE)
+        )
+        return {row['url']: row['size'] for row in rows}
+    
+    def save_posts(self, thread_id: str, posts: Iterable):
+        """
+        Сохранить посты треда (заменяет ранее сохранённые)
+        
+        Args:
+            thread_id: ID треда
+            posts: Записи parser.Post в порядке на странице
+        """
+        rows = [
+            (thread_id, position, post.number, post.posted_at, post.time, post.subject, post.text,
+             json.dumps(post.attachments, ensure_ascii=False))
+            for position, post in enumerate(posts)
+        ]
+        with self.lock:
+            self.conn.execute("DELETE FROM posts WHERE thread_id = ?", (thread_id,))
+            self.conn.executemany(
+                "INSERT INTO posts (thread_id, position, number, posted_at, time, subject, text, attachments) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows
+            )
+            self.conn.commit()
+    
+    def append_posts(self, thread_id: str, posts: Iterable, start: int) -> bool:
+        """
+        Дописать посты треда, начиная с позиции start
+        
+        Returns:
+            False если в базе не ровно start постов треда (тогда нужно
+            сохранить посты целиком через save_posts)
+        """
+        rows = [
+            (thread_id, position, post.number, post.posted_at, post.time, post.subject, post.text,
+             json.dumps(post.attachments, ensure_ascii=False))
+            for position, post in enumerate(posts, start)
+        ]
+        with self.lock:
+            saved = self.conn.execute("SELECT COUNT(*) FROM posts WHERE thread_id = ?", (thread_id,)).fetchone()[0]
+            if saved != start:
+                return False
+            self.conn.executemany(
+                "INSERT INTO posts (thread_id, position, number, posted_at, time, subject, text, attachments) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows
+            )
+            self.conn.commit()
+        return True
+    
+    def query_posts(self, tag_id: str = None, since: str = None, until: str = None,
+                    thread_id: str = None) -> List[sqlite3.Row]:
+        """
+        Выбрать посты из базы
+        
+        Args:
+            tag_id: Только треды этого тега
+            since: Не раньше этого времени ("2025-01-20" или "2025-01-20 16:00:00")
+            until: Раньше этого времени
+            thread_id: Только этот тред
+            
+        Returns:
+            Строки с полями thread_id, number, posted_at, time, subject, text,
+            attachments (JSON-список), tag_id; по возрастанию времени
+        """
+        conditions, params = [], []
+        if tag_id is not None:
+            conditions.append("t.tag_id = ?")
+            params.append(str(tag_id))
+        if since:
+            conditions.append("p.posted_at >= ?")
+            params.append(since)
+        if until:
+            conditions.append("p.posted_at < ?")
+            params.append(until)
+        if thread_id is not None:
+            conditions.append("p.thread_id = ?")
+            params.append(thread_id)
+        where = f"WHERE {' AND '.join(conditions)} " if conditions else ""
+        return self._query(
+            "SELECT p.thread_id, p.number, p.posted_at, p.time, p.subject, p.text, p.attachments, t.tag_id "
+            "FROM posts p LEFT JOIN threads t ON t.thread_id = p.thread_id "
+            f"{where}ORDER BY p.posted_at, p.thread_id, p.position",
+            tuple(params)
+        )
+
+
+def open_state() -> ContextManager[Optional[CrawlState]]:
+    """
+    Открыть базу состояния, если она включена (config.CRAWL_STATE_ENABLED)
+
+    Пример:
+        with open_state() as state:  # None, если база отключена
+            process_thread(parser, url, base_dir, state=state)
+    """
+    if config.CRAWL_STATE_ENABLED:
+        return CrawlState()
+    return nullcontext()
@@ -3,22 +3,32 @@
 """
 
 import os
-import io
+import re
+import json
+import time
 import asyncio
-from typing import List
-from dataclasses import dataclass
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import AsyncIterable, AsyncIterator, Callable, Dict, Iterable, List, Optional, Sized, Tuple, Union
+from dataclasses import dataclass, field
 
 import aiohttp
 import aiofiles
 from tqdm import tqdm
 
 import config
-from parser import MediaFile
+from parser import MediaFile, MediaManifest
+from ratelimit import rate_limiter
+from mediastore import MediaStore
+from concurrency import AdaptiveLimiter
 
 
 # Расширения изображений, которые можно конвертировать в JPG
 CONVERTIBLE_EXTENSIONS = ['.png', '.webp', '.bmp']
 
+# Сколько файлов на одного обработчика может ждать в очереди загрузки
+DOWNLOAD_QUEUE_FACTOR = 2
+
 
 @dataclass
 class DownloadStats:
@@ -29,7 +39,18 @@ class DownloadStats:
     skipped: int = 0
     converted: int = 0
     retried: int = 0
+    truncated: int = 0
+    resumed: int = 0
+    linked: int = 0
     total_bytes: int = 0
+    saved_bytes: int = 0
+    # Число одновременных загрузок в конце и изменения лимита с причинами
+    concurrency: int = 0
+    concurrency_changes: List[str] = field(default_factory=list)
+    # Время по стадиям (в секундах, суммарно по файлам)
+    download_time: float = 0.0
+    convert_time: float = 0.0
+    convert_wait_time: float = 0.0
     
     def __str__(self):
         result = (
@@ -44,6 +65,25 @@ class DownloadStats:
             result += f"\n  Конвертировано в JPG: {self.converted}"
         if self.retried > 0:
             result += f"\n  Повторных попыток: {self.retried}"
+        if self.resumed > 0:
+            result += f"\n  Докачано с места обрыва: {self.resumed}"
+        if self.truncated > 0:
+            result += f"\n  Перекачано (размер не совпал с сохранённым): {self.truncated}"
+        if self.linked > 0:
+            result += (
+                f"\n  Взято из общего хранилища: {self.linked} "
+                f"(сэкономлено {self._format_bytes(self.saved_bytes)})"
+            )
+        if self.concurrency_changes:
+            result += (
+                f"\n  Одновременных загрузок: {self.concurrency} "
+                f"(изменений: {len(self.concurrency_changes)}, последнее: {self.concurrency_changes[-1]})"
+            )
+        if self.converted > 0:
+            result += (
+                f"\n  Время стадий: загрузка {self.download_time:.1f} с, "
+                f"конвертация {self.convert_time:.1f} с (ожидание очереди {self.convert_wait_time:.1f} с)"
+            )
         return result
     
     def _format_bytes(self, bytes_count: int) -> str:
@@ -55,41 +95,76 @@ class DownloadStats:
         return f"{bytes_count:.2f} ТБ"
 
 
-def convert_image_to_jpg(content: bytes, quality: int = 85) -> bytes:
+def _to_rgb(img):
+    """Привести изображение к RGB (прозрачность заливается белым)"""
+    from PIL import Image
+    
+    if img.mode in ('RGBA', 'LA', 'P'):
+        # Создаём белый фон для прозрачных изображений
+        background = Image.new('RGB', img.size, (255, 255, 255))
+        if img.mode == 'P':
+            img = img.convert('RGBA')
+        background.paste(img, mask=img.split()[-1] if img.mode == 'RGBA' else None)
+        return background
+    elif img.mode != 'RGB':
+        return img.convert('RGB')
+    return img
+
+
+def convert_image_file_to_jpg(src_path: str, dst_path: str, quality: int = 85) -> bool:
     """
-    Конвертировать изображение в JPG
+    Конвертировать файл изображения в JPG
     
     Args:
-        content: Бинарные данные изображения
+        src_path: Путь к исходному изображению
+        dst_path: Путь для сохранения JPG
         quality: Качество JPG (1-100)
         
     Returns:
-        Бинарные данные JPG изображения
+        True если конвертация удалась
     """
     try:
         from PIL import Image
         
-        # Открываем изображение из байтов
-        img = Image.open(io.BytesIO(content))
-        
-        # Конвертируем в RGB если нужно (для PNG с прозрачностью)
-        if img.mode in ('RGBA', 'LA', 'P'):
-            # Создаём белый фон для прозрачных изображений
-            background = Image.new('RGB', img.size, (255, 255, 255))
-            if img.mode == 'P':
-                img = img.convert('RGBA')
-            background.paste(img, mask=img.split()[-1] if img.mode == 'RGBA' else None)
-            img = background
-        elif img.mode != 'RGB':
-            img = img.convert('RGB')
-        
-        # Сохраняем в JPG
-        output = io.BytesIO()
-        img.save(output, format='JPEG', quality=quality, optimize=True)
-        return output.getvalue()
+        with Image.open(src_path) as img:
+            _to_rgb(img).save(dst_path, format='JPEG', quality=quality, optimize=True)
+        return True
     except Exception:
-        # Если конвертация не удалась, возвращаем исходные данные
-        return content
+        if os.path.exists(dst_path):
+            os.remove(dst_path)
+        return False
+
+
+def _remove_file(path: str):
+    """Удалить файл, если он существует"""
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def _load_part_meta(meta_path: str) -> Optional[dict]:
+    """Загрузить сведения о недокачанном файле (.part.meta)"""
+    try:
+        with open(meta_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _save_part_meta(meta_path: str, meta: dict):
+    """Сохранить сведения о недокачанном файле (.part.meta)"""
+    try:
+        with open(meta_path, 'w', encoding='utf-8') as f:
+            json.dump(meta, f)
+    except OSError:
+        pass
+
+
+def _discard_part(part_path: str):
+    """Удалить недокачанный файл вместе с его сведениями"""
+    _remove_file(part_path)
+    _remove_file(part_path + '.meta')
 
 
 def get_jpg_filename(filename: str) -> str:
@@ -108,75 +183,236 @@ def should_convert(filename: str) -> bool:
     return ext in CONVERTIBLE_EXTENSIONS
 
 
-def file_exists(output_dir: str, filename: str) -> bool:
+def scan_media_dir(output_dir: str) -> Dict[str, int]:
     """
-    Проверить существует ли файл (с учётом возможной конвертации)
-    """
-    # Проверяем оригинальное имя
-    if os.path.exists(os.path.join(output_dir, filename)):
-        return True
+    Прочитать содержимое папки медиа одним проходом
     
-    # Проверяем сконвертированное имя
-    if should_convert(filename):
-        jpg_filename = get_jpg_filename(filename)
-        if os.path.exists(os.path.join(output_dir, jpg_filename)):
-            return True
-    
-    # Проверяем обратное - если конвертация выключена, но файл был сконвертирован ранее
-    base, ext = os.path.splitext(filename)
-    if ext.lower() in CONVERTIBLE_EXTENSIONS:
-        if os.path.exists(os.path.join(output_dir, base + '.jpg')):
-            return True
+    Returns:
+        Имя файла -> размер (пустой словарь, если папки нет)
+    """
+    index = {}
+    try:
+        with os.scandir(output_dir) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_file():
+                        index[entry.name] = entry.stat().st_size
+                except OSError:
+                    continue
+    except OSError:
+        pass
+    return index
+
+
+def find_existing(index: Dict[str, int], filename: str) -> Optional[str]:
+    """
+    Найти уже загруженный файл в индексе папки (с учётом конвертации)
     
-    return False
+    Returns:
+        Имя найденного файла (исходное или .jpg) или None
+    """
+    if filename in index:
+        return filename
+    # Сконвертированный файл - при любом значении CONVERT_IMAGES_TO_JPG
+    jpg_filename = get_jpg_filename(filename)
+    if jpg_filename != filename and jpg_filename in index:
+        return jpg_filename
+    return None
 
 
 class MediaDownloader:
     """Асинхронный загрузчик медиа-файлов"""
     
-    def __init__(self, max_concurrent: int = None, max_retries: int = None):
+    def __init__(self, max_concurrent: int = None, max_retries: int = None, store: MediaStore = None):
         self.max_concurrent = max_concurrent or config.MAX_CONCURRENT_DOWNLOADS
         self.max_retries = max_retries or config.DOWNLOAD_RETRIES
+        self.store = store
         self.stats = DownloadStats()
-        self.semaphore = None
+        # Обработчик результата по каждому файлу: (media, успех, размер)
+        self.on_file_done: Optional[Callable[[MediaFile, bool, int], None]] = None
+        # Результат по имени файла: (успех, размер)
+        self.results: Dict[str, Tuple[bool, int]] = {}
+        # Содержимое папки загрузки (имя -> размер) и ожидаемые размеры по URL
+        self.media_index: Dict[str, int] = {}
+        self.expected_sizes: Dict[str, int] = {}
+        # Лимит одновременных загрузок сохраняется между вызовами download_media_files
+        self.limiter = AdaptiveLimiter(self.max_concurrent)
+        # Пул процессов для конвертации в JPG (создаётся при первой конвертации)
+        self.convert_executor = None
+        self.convert_slots = None
         self.session = None
     
     async def _init_session(self):
         """Инициализировать HTTP-сессию"""
         if self.session is None:
-            timeout = aiohttp.ClientTimeout(total=config.REQUEST_TIMEOUT)
+            # Общий таймаут не ставим: большое видео может качаться дольше
+            # REQUEST_TIMEOUT, обрывается только зависшее соединение
+            timeout = aiohttp.ClientTimeout(
+                total=None,
+                sock_connect=config.REQUEST_TIMEOUT,
+                sock_read=config.REQUEST_TIMEOUT
+            )
+            # Пул соединений с keep-alive и кешем DNS, общий для всех загрузок сессии
+            connector = aiohttp.TCPConnector(
+                limit=self.limiter.maximum,
+                ttl_dns_cache=config.DNS_CACHE_TTL,
+                keepalive_timeout=config.KEEPALIVE_TIMEOUT
+            )
             self.session = aiohttp.ClientSession(
                 timeout=timeout,
+                connector=connector,
                 headers={'User-Agent': config.USER_AGENT}
             )
     
     async def _close_session(self):
-        """Закрыть HTTP-сессию"""
+        """Закрыть HTTP-сессию и пул конвертации"""
         if self.session:
             await self.session.close()
             self.session = None
+        if self.convert_executor:
+            self.convert_executor.shutdown(wait=True, cancel_futures=True)
+            self.convert_executor = None
+    
+    def _get_convert_executor(self) -> Optional[ProcessPoolExecutor]:
+        """Пул процессов конвертации (None = пул потоков event loop)"""
+        if self.convert_executor is None and config.CONVERT_WORKERS > 0:
+            # spawn: загрузчик может работать в рабочем потоке, fork там небезопасен
+            self.convert_executor = ProcessPoolExecutor(config.CONVERT_WORKERS,
+                                                        mp_context=multiprocessing.get_context('spawn'))
+        return self.convert_executor
     
-    async def _download_with_retry(self, url: str) -> bytes:
+    async def _convert(self, src_path: str, dst_path: str) -> bool:
         """
-        Загрузить файл с повторными попытками при ошибке
+        Конвертировать загруженный файл в JPG
+        
+        Слот загрузки к этому моменту уже освобождён. Одновременно ждут
+        и выполняются не больше CONVERT_QUEUE_SIZE конвертаций: если пул
+        не успевает, загрузки новых файлов приостанавливаются.
+        
+        Returns:
+            True если конвертация удалась
+        """
+        waited = time.monotonic()
+        async with self.convert_slots:
+            started = time.monotonic()
+            self.stats.convert_wait_time += started - waited
+            try:
+                return await asyncio.get_running_loop().run_in_executor(
+                    self._get_convert_executor(), convert_image_file_to_jpg, src_path, dst_path, config.JPG_QUALITY
+                )
+            except Exception:
+                # Упавший процесс пула: файл сохраняется без конвертации
+                _remove_file(dst_path)
+                if self.convert_executor is not None:
+                    self.convert_executor.shutdown(wait=False, cancel_futures=True)
+                    self.convert_executor = None
+                return False
+            finally:
+                self.stats.convert_time += time.monotonic() - started
+    
+    def _resume_offset(self, url: str, part_path: str) -> int:
+        """
+        Определить, с какого байта можно продолжить загрузку
+        
+        Продолжать можно только если .part принадлежит тому же URL
+        и для него известен валидатор (ETag или Last-Modified).
+        """
+        meta = _load_part_meta(part_path + '.meta')
+        if not meta or meta.get('url') != url or not (meta.get('etag') or meta.get('last_modified')):
+            _discard_part(part_path)
+            return 0
+        try:
+            return os.path.getsize(part_path)
+        except OSError:
+            return 0
+    
+    async def _download_with_retry(self, url: str, filepath: str) -> bool:
+        """
+        Загрузить файл на диск с повторными попытками при ошибке
+        
+        Файл пишется по частям размером DOWNLOAD_CHUNK_SIZE, поэтому
+        память на одну загрузку не зависит от размера файла. Недокачанный
+        файл остаётся на диске вместе с filepath.meta (URL, ETag,
+        Last-Modified, размер) и докачивается Range-запросом - как при
+        повторной попытке, так и при следующем запуске.
         
         Returns:
-            Байты файла или None при ошибке
+            True если файл полностью загружен
         """
+        meta_path = filepath + '.meta'
         last_error = None
         
         for attempt in range(self.max_retries):
             try:
-                async with self.session.get(url) as response:
-                    if response.status == 200:
-                        return await response.read()
+                offset = self._resume_offset(url, filepath)
+                meta = _load_part_meta(meta_path) if offset else None
+                mode = None
+                headers = {}
+                if offset:
+                    headers['Range'] = f'bytes={offset}-'
+                    headers['If-Range'] = meta.get('etag') or meta.get('last_modified')
+                
+                await rate_limiter.acquire_async(url)
+                started = time.monotonic()
+                async with self.session.get(url, headers=headers) as response:
+                    latency = time.monotonic() - started
+                    if response.status == 429 or response.status >= 500:
+                        # Сервер перегружен - уменьшаем число одновременных загрузок
+                        self.limiter.record_overload(f"HTTP {response.status}")
+                    
+                    if response.status == 206 and offset:
+                        # Проверяем, что сервер продолжает именно наш файл
+                        match = re.match(r'bytes (\d+)-\d+/(\d+|\*)', response.headers.get('Content-Range', ''))
+                        total = meta.get('length')
+                        if (not match or int(match.group(1)) != offset
+                                or (total and match.group(2) != '*' and int(match.group(2)) != total)):
+                            # Повтор - с нуля, через обычную паузу между попытками
+                            _discard_part(filepath)
+                            last_error = "Invalid Content-Range"
+                        else:
+                            mode = 'ab'
+                            self.stats.resumed += 1
+                    elif response.status == 200:
+                        # Сервер отдал файл целиком (новая загрузка или файл изменился)
+                        length = response.headers.get('Content-Length')
+                        meta = {
+                            'url': url,
+                            'etag': response.headers.get('ETag'),
+                            'last_modified': response.headers.get('Last-Modified'),
+                            'length': int(length) if length and length.isdigit() else None
+                        }
+                        _save_part_meta(meta_path, meta)
+                        mode = 'wb'
+                    elif response.status == 416 and offset:
+                        # Запрошенный диапазон за концом файла: .part уже полный или чужой
+                        if meta.get('length') and offset == meta['length']:
+                            _remove_file(meta_path)
+                            return True
+                        _discard_part(filepath)
+                        last_error = "HTTP 416"
                     elif response.status == 404:
                         # Файл не найден, повторять бессмысленно
-                        return None
+                        _discard_part(filepath)
+                        return False
                     else:
                         last_error = f"HTTP {response.status}"
+                        mode = None
+                    
+                    if mode:
+                        async with aiofiles.open(filepath, mode) as f:
+                            async for chunk in response.content.iter_chunked(config.DOWNLOAD_CHUNK_SIZE):
+                                await f.write(chunk)
+                        
+                        size = os.path.getsize(filepath)
+                        if meta.get('length') and size != meta['length']:
+                            last_error = "Incomplete"
+                        else:
+                            _remove_file(meta_path)
+                            self.limiter.record_success(size - offset if mode == 'ab' else size, latency)
+                            return True
             except asyncio.TimeoutError:
                 last_error = "Timeout"
+                self.limiter.record_overload("таймаут")
             except aiohttp.ClientError as e:
                 last_error = str(e)
             except Exception as e:
@@ -187,95 +423,283 @@ class MediaDownloader:
                 self.stats.retried += 1
                 await asyncio.sleep(1 * (attempt + 1))  # Увеличивающаяся задержка
         
-        return None
+        return False
+    
+    def _report(self, media: MediaFile, ok: bool, size: int = 0):
+        """Сообщить обработчику результат загрузки файла"""
+        self.results[media.filename] = (ok, size)
+        if self.on_file_done is not None:
+            self.on_file_done(media, ok, size)
     
     async def _download_file(self, media: MediaFile, output_dir: str, pbar: tqdm) -> bool:
         """
         Загрузить один файл
         
+        Файл качается во временный .part и переименовывается в финальное
+        имя только после успешной загрузки (и конвертации), поэтому
+        под финальным именем никогда не лежит недокачанный файл.
+        
         Returns:
             True если файл успешно загружен или уже существует
         """
-        # Проверяем, существует ли файл (с учётом конвертации)
-        if file_exists(output_dir, media.filename):
-            self.stats.skipped += 1
-            pbar.update(1)
-            return True
+        expected = self.expected_sizes.get(media.url)
+        
+        # Проверяем, существует ли файл (с учётом конвертации) - по индексу папки
+        existing = find_existing(self.media_index, media.filename)
+        if existing is not None:
+            size = self.media_index[existing]
+            if not expected or size == expected:
+                self.stats.skipped += 1
+                self._report(media, True, size)
+                pbar.update(1)
+                return True
+            # Размер не совпадает с записанным при загрузке - файл повреждён
+            _remove_file(os.path.join(output_dir, existing))
+            self.stats.truncated += 1
         
         # Определяем финальное имя файла
-        if should_convert(media.filename):
+        convert = should_convert(media.filename)
+        if convert:
             final_filename = get_jpg_filename(media.filename)
         else:
             final_filename = media.filename
         
         filepath = os.path.join(output_dir, final_filename)
+        part_path = os.path.join(output_dir, media.filename + '.part')
+        
+        if self.store is not None and expected:
+            # Повреждённая копия в хранилище испортила бы и другие треды
+            store_path = self.store.lookup(final_filename)
+            if store_path and os.path.getsize(store_path) != expected:
+                _remove_file(store_path)
+        
+        # Файл уже скачивался для другого треда - берём из общего хранилища
+        if self.store is not None and self.store.materialize(final_filename, filepath):
+            size = os.path.getsize(filepath)
+            self.stats.linked += 1
+            self.stats.saved_bytes += size
+            self._report(media, True, size)
+            pbar.update(1)
+            return True
+        
+        # Слот загрузки занят только на время сетевой загрузки
+        started = time.monotonic()
+        async with self.limiter:
+            downloaded = await self._download_with_retry(media.url, part_path)
+        self.stats.download_time += time.monotonic() - started
         
-        async with self.semaphore:
-            content = await self._download_with_retry(media.url)
+        if not downloaded:
+            # .part не удаляем: его можно будет докачать позже
+            self.stats.failed += 1
+            self._report(media, False)
+            pbar.update(1)
+            return False
+        
+        try:
+            # Конвертируем в JPG если нужно
+            if convert:
+                converted_path = filepath + '.tmp'
+                if await self._convert(part_path, converted_path):
+                    os.replace(converted_path, filepath)
+                    _remove_file(part_path)
+                else:
+                    # Если конвертация не удалась, сохраняем исходные данные
+                    os.replace(part_path, filepath)
+                self.stats.converted += 1
+            else:
+                os.replace(part_path, filepath)
             
-            if content is None:
-                self.stats.failed += 1
-                pbar.update(1)
-                return False
+            if self.store is not None:
+                self.store.add(filepath, final_filename)
             
+            size = os.path.getsize(filepath)
+            self.stats.completed += 1
+            self.stats.total_bytes += size
+            self._report(media, True, size)
+            pbar.update(1)
+            return True
+        except Exception:
+            _discard_part(part_path)
+            self.stats.failed += 1
+            self._report(media, False)
+            pbar.update(1)
+            return False
+    
+    async def _worker(self, queue: asyncio.Queue, output_dir: str, pbar: tqdm):
+        """Обработчик пула: качает файлы из очереди до маркера окончания"""
+        while True:
+            media = await queue.get()
+            if media is None:
+                return
             try:
-                # Конвертируем в JPG если нужно
-                if should_convert(media.filename):
-                    content = await asyncio.get_event_loop().run_in_executor(
-                        None, convert_image_to_jpg, content, config.JPG_QUALITY
-                    )
-                    self.stats.converted += 1
-                
-                async with aiofiles.open(filepath, 'wb') as f:
-                    await f.write(content)
-                
-                self.stats.completed += 1
-                self.stats.total_bytes += len(content)
-                pbar.update(1)
-                return True
+                await self._download_file(media, output_dir, pbar)
             except Exception:
                 self.stats.failed += 1
+                self._report(media, False)
                 pbar.update(1)
-                return False
     
-    async def download_media_files(self, media_files: List[MediaFile], output_dir: str) -> DownloadStats:
+    async def download_media_files(self, media_files: Union[Iterable[MediaFile], AsyncIterable[MediaFile]],
+                                   output_dir: str,
+                                   on_file_done: Callable[[MediaFile, bool, int], None] = None,
+                                   expected_sizes: Dict[str, int] = None) -> DownloadStats:
         """
         Загрузить список медиа-файлов
         
+        Файлы раздаются фиксированному пулу обработчиков через ограниченную
+        очередь, поэтому память не зависит от длины списка, а источник
+        может быть асинхронным итератором, который выдаёт файлы по мере
+        их обнаружения.
+        
+        Уже загруженные файлы определяются по одному чтению папки,
+        без отдельного stat на каждый файл.
+        
         Args:
-            media_files: Список файлов для загрузки
+            media_files: Файлы для загрузки (список, MediaManifest или async-итератор)
             output_dir: Директория для сохранения
+            on_file_done: Вызывается по каждому файлу с (media, успех, размер)
+            expected_sizes: Размеры уже загруженных файлов по URL; файл
+                другого размера на диске загружается заново
             
         Returns:
             Статистика загрузки
         """
+        self.on_file_done = on_file_done
+        self.expected_sizes = expected_sizes or {}
         # Создаем директорию если её нет
         os.makedirs(output_dir, exist_ok=True)
+        self.media_index = scan_media_dir(output_dir)
         
         # Сбрасываем статистику
-        self.stats = DownloadStats(total=len(media_files))
-        self.semaphore = asyncio.Semaphore(self.max_concurrent)
+        total = len(media_files) if isinstance(media_files, Sized) else None
+        self.stats = DownloadStats(total=total or 0)
+        self.limiter.events.clear()
+        
+        # Обработчиков столько, сколько загрузок может разрешить лимит, плюс
+        # ожидающие конвертации: они не должны отнимать обработчиков у загрузок
+        self.convert_slots = asyncio.Semaphore(max(1, config.CONVERT_QUEUE_SIZE))
+        workers_count = self.limiter.maximum + max(1, config.CONVERT_QUEUE_SIZE)
+        queue = asyncio.Queue(maxsize=workers_count * DOWNLOAD_QUEUE_FACTOR)
+        # Повтор того же файла под другим URL не качается,
+        # а получает результат (и размер) первого
+        self.results = {}
+        duplicates: List[MediaFile] = []
         
+        # Если сессия уже открыта снаружи (MediaDownloadSession), не закрываем её
+        owns_session = self.session is None
         await self._init_session()
         
         try:
             # Создаем прогресс-бар
-            with tqdm(total=len(media_files), desc="Загрузка медиа", unit="файл") as pbar:
-                # Создаем задачи для всех файлов
-                tasks = [
-                    self._download_file(media, output_dir, pbar)
-                    for media in media_files
+            with tqdm(total=total, desc="Загрузка медиа", unit="файл") as pbar:
+                workers = [
+                    asyncio.create_task(self._worker(queue, output_dir, pbar))
+                    for _ in range(workers_count)
                 ]
+                try:
+                    queued = MediaManifest()
+                    async for media in _iterate(media_files):
+                        if total is None:
+                            self.stats.total += 1
+                        if queued.has_filename(media.filename):
+                            duplicates.append(media)
+                            continue
+                        queued.add(media)
+                        await queue.put(media)
+                    
+                    for _ in workers:
+                        await queue.put(None)
+                    await asyncio.gather(*workers)
+                finally:
+                    for worker in workers:
+                        worker.cancel()
                 
-                # Выполняем все задачи
-                await asyncio.gather(*tasks)
+                for media in duplicates:
+                    self.stats.skipped += 1
+                    ok, size = self.results.get(media.filename, (False, 0))
+                    self._report(media, ok, size)
+                    pbar.update(1)
         finally:
-            await self._close_session()
+            if owns_session:
+                await self._close_session()
         
+        self.stats.concurrency = self.limiter.limit
+        self.stats.concurrency_changes = list(self.limiter.events)
         return self.stats
 
 
-def download_media_sync(media_files: List[MediaFile], output_dir: str, max_concurrent: int = None) -> DownloadStats:
+async def _iterate(media_files: Union[Iterable[MediaFile], AsyncIterable[MediaFile]]) -> AsyncIterator[MediaFile]:
+    """Перебрать обычный или асинхронный источник файлов"""
+    if isinstance(media_files, AsyncIterable):
+        async for media in media_files:
+            yield media
+    else:
+        for media in media_files:
+            yield media
+
+
+class MediaDownloadSession:
+    """
+    Загрузчик медиа на всё время работы программы
+    
+    Держит один event loop и одну HTTP-сессию с пулом соединений,
+    поэтому TCP/TLS-соединения и DNS-записи переиспользуются между тредами.
+    Все вызовы download() должны выполняться из одного потока.
+    
+    Пример:
+        with MediaDownloadSession() as downloader:
+            for thread in threads:
+                downloader.download(media_files, media_dir)
+    """
+    
+    def __init__(self, max_concurrent: int = None, max_retries: int = None):
+        store = MediaStore() if config.MEDIA_STORE_ENABLED else None
+        self.downloader = MediaDownloader(max_concurrent, max_retries, store)
+        self.loop = None
+    
+    def __enter__(self):
+        self.loop = asyncio.new_event_loop()
+        self.loop.run_until_complete(self.downloader._init_session())
+        return self
+    
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+    
+    def close(self):
+        """Закрыть HTTP-сессию и event loop"""
+        if self.loop is None:
+            return
+        try:
+            self.loop.run_until_complete(self.downloader._close_session())
+            self.loop.run_until_complete(self.loop.shutdown_asyncgens())
+        finally:
+            self.loop.close()
+            self.loop = None
+    
+    def download(self, media_files: Union[Iterable[MediaFile], AsyncIterable[MediaFile]], output_dir: str,
+                 on_file_done: Callable[[MediaFile, bool, int], None] = None,
+                 expected_sizes: Dict[str, int] = None) -> DownloadStats:
+        """
+        Загрузить список медиа-файлов через общую сессию
+        
+        Args:
+            media_files: Файлы для загрузки (список, MediaManifest или async-итератор)
+            output_dir: Директория для сохранения
+            on_file_done: Вызывается по каждому файлу с (media, успех, размер)
+            expected_sizes: Размеры уже загруженных файлов по URL
+            
+        Returns:
+            Статистика загрузки
+        """
+        if self.loop is None:
+            raise RuntimeError("MediaDownloadSession не открыта")
+        return self.loop.run_until_complete(
+            self.downloader.download_media_files(media_files, output_dir, on_file_done, expected_sizes)
+        )
+
+
+def download_media_sync(media_files: List[MediaFile], output_dir: str, max_concurrent: int = None,
+                        on_file_done: Callable[[MediaFile, bool, int], None] = None,
+                        expected_sizes: Dict[str, int] = None) -> DownloadStats:
     """
     Синхронная обёртка для загрузки медиа
     
@@ -283,9 +707,11 @@ def download_media_sync(media_files: List[MediaFile], output_dir: str, max_concu
         media_files: Список файлов для загрузки
         output_dir: Директория для сохранения
         max_concurrent: Максимальное количество одновременных загрузок
+        on_file_done: Вызывается по каждому файлу с (media, успех, размер)
+        expected_sizes: Размеры уже загруженных файлов по URL
         
     Returns:
         Статистика загрузки
     """
-    downloader = MediaDownloader(max_concurrent)
-    return asyncio.run(downloader.download_media_files(media_files, output_dir))
+    with MediaDownloadSession(max_concurrent) as downloader:
+        return downloader.download(media_files, output_dir, on_file_done, expected_sizes)
@@ -8,7 +8,6 @@ import re
 import sys
 import json
 import subprocess
-import time
 import importlib.metadata
 from typing import Optional, Dict, List
 from dataclasses import dataclass, asdict
@@ -63,6 +62,7 @@ class MonitorItem:
     last_check: str = ""
     last_posts_count: int = 0
     is_active: bool = True
+    last_post_number: str = ""  # номер последнего обработанного поста треда
 
 
 def clear_screen():
@@ -291,6 +291,19 @@ twst.downloader [module] - Модуль загрузки тредов с Арх
     input("\nНажмите Enter для возврата в меню...")
 
 
+def set_max_concurrent(value: int):
+    """
+    Задать число одновременных загрузок медиа
+    
+    Адаптивный подбор может уменьшить его при перегрузке сервера,
+    но не поднимет выше заданного значения.
+    """
+    import config
+    config.MAX_CONCURRENT_DOWNLOADS = value
+    config.ADAPTIVE_MAX_CONCURRENT = value
+    config.ADAPTIVE_MIN_CONCURRENT = min(config.ADAPTIVE_MIN_CONCURRENT, value)
+
+
 def show_settings():
     """Меню настроек"""
     import config
@@ -334,7 +347,7 @@ def show_settings():
         elif choice == '3':
             new_val = input(f"\nВведите количество (1-30) [{config.MAX_CONCURRENT_DOWNLOADS}]: ").strip()
             if new_val.isdigit() and 1 <= int(new_val) <= 30:
-                config.MAX_CONCURRENT_DOWNLOADS = int(new_val)
+                set_max_concurrent(int(new_val))
                 print("[OK] Значение изменено")
             else:
                 print("[X] Значение должно быть от 1 до 30")
@@ -382,18 +395,12 @@ def show_settings():
             input("\nНажмите Enter для продолжения...")
 
 
-def sanitize_folder_name(name: str) -> str:
-    """Очистить имя папки от недопустимых символов"""
-    name = re.sub(r'[<>:"/\\|?*]', '_', name)
-    name = name.strip(' .')
-    return name[:200] if name else 'thread'
-
-
 def download_single_thread_interactive():
     """Интерактивная загрузка отдельного треда"""
     import config
     from parser import ArhivachParser
-    from downloader import download_media_sync
+    from crawlstate import open_state
+    from pipeline import prepare_thread, download_thread_media
     
     clear_screen()
     print_header()
@@ -413,64 +420,54 @@ def download_single_thread_interactive():
     print(f"\n[*] Загрузка треда: {thread_url}")
     print_separator()
     
-    parser = ArhivachParser(domain=config.ARHIVACH_DOMAIN)
-    
-    # Парсим тред
-    print("[*] Парсинг страницы треда...")
-    html_content, media_files, thread_date, thread_id, resource_files = parser.parse_thread(thread_url)
-    
-    if not html_content:
-        print("[X] Ошибка: не удалось загрузить тред")
-        input("\nНажмите Enter для продолжения...")
-        return
-    
-    # Формируем имя папки: ДД.ММ.ГГ_ID
-    folder_name = parser.get_folder_name(thread_date, thread_id)
-    folder_name = sanitize_folder_name(folder_name)
-    thread_dir = os.path.join(config.OUTPUT_DIR, folder_name)
-    media_dir = os.path.join(thread_dir, 'media')
-    resources_dir = os.path.join(thread_dir, 'resources')
-    
-    os.makedirs(thread_dir, exist_ok=True)
-    os.makedirs(media_dir, exist_ok=True)
-    os.makedirs(resources_dir, exist_ok=True)
-    
-    # Скачиваем ресурсы (CSS/JS)
-    if resource_files:
-        print(f"[*] Загрузка ресурсов ({len(resource_files)} файлов)...")
-        for res in resource_files:
-            res_path = os.path.join(resources_dir, res.filename)
-            parser.download_resource(res.url, res_path)
-    
-    # Сохраняем HTML
-    html_path = os.path.join(thread_dir, 'thread.html')
-    with open(html_path, 'w', encoding='utf-8') as f:
-        f.write(html_content)
-    print(f"[OK] HTML сохранён: {html_path}")
-    
-    # Статистика медиа
-    print_separator()
-    print("\n[*] СТАТИСТИКА МЕДИА-ФАЙЛОВ:")
-    images = sum(1 for m in media_files if m.file_type == 'image')
-    videos = sum(1 for m in media_files if m.file_type == 'video')
-    other = sum(1 for m in media_files if m.file_type == 'other')
-    
-    print(f"  Изображений: {images}")
-    print(f"  Видео: {videos}")
-    print(f"  Прочих файлов: {other}")
-    print(f"  Всего: {len(media_files)}")
-    
-    if media_files:
-        print_separator()
-        print("\n[>] Загрузка медиа-файлов...\n")
-        stats = download_media_sync(media_files, media_dir)
+    # Посты и загруженные медиа записываются в базу, как при загрузке по тегу
+    with open_state() as state:
+        parser = ArhivachParser(domain=config.ARHIVACH_DOMAIN)
+        
+        # Парсим тред, сохраняем HTML и ресурсы (CSS/JS)
+        print("[*] Парсинг страницы треда...")
+        prepared = prepare_thread(parser, thread_url, config.OUTPUT_DIR, state=state)
+        
+        if prepared is None:
+            print("[X] Ошибка: не удалось загрузить тред")
+            input("\nНажмите Enter для продолжения...")
+            return
         
+        thread_dir = prepared.thread_dir
+        media_files = prepared.media_files
+        html_path = os.path.join(thread_dir, 'thread.html')
+        print(f"[OK] HTML сохранён: {html_path}")
+        
+        # Статистика медиа
         print_separator()
-        print("\n[*] РЕЗУЛЬТАТ ЗАГРУЗКИ:")
-        print(f"  Загружено: {stats.completed}")
-        print(f"  Пропущено (уже есть): {stats.skipped}")
-        print(f"  Ошибок: {stats.failed}")
-        print(f"  Загружено данных: {stats._format_bytes(stats.total_bytes)}")
+        print("\n[*] СТАТИСТИКА МЕДИА-ФАЙЛОВ:")
+        images = sum(1 for m in media_files if m.file_type == 'image')
+        videos = sum(1 for m in media_files if m.file_type == 'video')
+        other = sum(1 for m in media_files if m.file_type == 'other')
+        
+        print(f"  Изображений: {images}")
+        print(f"  Видео: {videos}")
+        print(f"  Прочих файлов: {other}")
+        print(f"  Всего: {len(media_files)}")
+        if prepared.media_done:
+            print(f"  Уже загружено ранее: {prepared.media_done}")
+        
+        if media_files:
+            print_separator()
+            print("\n[>] Загрузка медиа-файлов...\n")
+        if prepared.is_new:
+            # Вызывается и без медиа: тред отмечается в базе состояния загруженным
+            stats = download_thread_media(prepared, state=state)
+        
+        if media_files:
+            print_separator()
+            print("\n[*] РЕЗУЛЬТАТ ЗАГРУЗКИ:")
+            print(f"  Загружено: {stats.completed}")
+            print(f"  Пропущено (уже есть): {stats.skipped}")
+            if stats.linked:
+                print(f"  Из общего хранилища: {stats.linked}")
+            print(f"  Ошибок: {stats.failed}")
+            print(f"  Загружено данных: {stats._format_bytes(stats.total_bytes)}")
     
     print_separator()
     print(f"\n[OK] Тред сохранён в: {thread_dir}")
@@ -480,8 +477,8 @@ def download_single_thread_interactive():
 def download_by_tag_interactive():
     """Интерактивная загрузка тредов по тегу"""
     import config
-    from parser import ArhivachParser
-    from downloader import download_media_sync
+    from parser import ArhivachParser, get_all_threads_from_tag_concurrent
+    from pipeline import ThreadPipeline
     
     clear_screen()
     print_header()
@@ -528,7 +525,7 @@ def download_by_tag_interactive():
     
     # Получаем список тредов
     print("\n[*] Получение списка тредов...")
-    threads = parser.get_all_threads_from_tag(tag_id, max_pages)
+    threads = get_all_threads_from_tag_concurrent(tag_id, max_pages, config.ARHIVACH_DOMAIN)
     
     if not threads:
         print("[X] Треды не найдены")
@@ -551,73 +548,21 @@ def download_by_tag_interactive():
     tag_dir = os.path.join(config.OUTPUT_DIR, f"tag_{tag_id}")
     os.makedirs(tag_dir, exist_ok=True)
     
-    # Статистика
-    successful = 0
-    failed = 0
-    total_media = 0
-    total_bytes = 0
-    
     print_separator()
     print("\n[>] ЗАГРУЗКА ТРЕДОВ\n")
     
-    for i, thread in enumerate(threads, 1):
-        print(f"\n[{i}/{len(threads)}] {thread.title[:50]}...")
-        
-        try:
-            html_content, media_files, thread_date, thread_id, resource_files = parser.parse_thread(thread.url)
-            
-            if not html_content:
-                print("  [X] Ошибка загрузки")
-                failed += 1
-                continue
-            
-            # Формируем имя папки: ДД.ММ.ГГ_ID
-            folder_name = parser.get_folder_name(thread_date, thread_id)
-            folder_name = sanitize_folder_name(folder_name)
-            thread_dir = os.path.join(tag_dir, folder_name)
-            media_dir = os.path.join(thread_dir, 'media')
-            resources_dir = os.path.join(thread_dir, 'resources')
-            
-            os.makedirs(thread_dir, exist_ok=True)
-            os.makedirs(media_dir, exist_ok=True)
-            os.makedirs(resources_dir, exist_ok=True)
-            
-            # Скачиваем ресурсы (CSS/JS)
-            for res in resource_files:
-                res_path = os.path.join(resources_dir, res.filename)
-                parser.download_resource(res.url, res_path)
-            
-            # Сохраняем HTML
-            html_path = os.path.join(thread_dir, 'thread.html')
-            with open(html_path, 'w', encoding='utf-8') as f:
-                f.write(html_content)
-            
-            # Загружаем медиа
-            if media_files:
-                stats = download_media_sync(media_files, media_dir)
-                total_media += stats.completed
-                total_bytes += stats.total_bytes
-                print(f"  [OK] HTML + {stats.completed} медиа-файлов")
-            else:
-                print("  [OK] HTML сохранён (медиа нет)")
-            
-            successful += 1
-            
-        except Exception as e:
-            print(f"  [X] Ошибка: {e}")
-            failed += 1
-        
-        # Задержка между тредами
-        if i < len(threads):
-            time.sleep(config.PAGE_REQUEST_DELAY)
+    # Парсинг следующего треда идёт параллельно с загрузкой медиа текущего
+    crawl_stats = ThreadPipeline(parser, tag_dir, tag_id=tag_id).run(threads)
     
     # Итоговая статистика
     print_separator()
     print("\n[*] ИТОГОВАЯ СТАТИСТИКА:")
-    print(f"  Успешно загружено: {successful}/{len(threads)} тредов")
-    print(f"  Ошибок: {failed}")
-    print(f"  Всего медиа-файлов: {total_media}")
-    print(f"  Загружено данных: {format_bytes(total_bytes)}")
+    print(f"  Успешно загружено: {crawl_stats.successful}/{len(threads)} тредов")
+    if crawl_stats.skipped:
+        print(f"  Пропущено (уже загружены): {crawl_stats.skipped}")
+    print(f"  Ошибок: {crawl_stats.failed}")
+    print(f"  Всего медиа-файлов: {crawl_stats.total_media}")
+    print(f"  Загружено данных: {format_bytes(crawl_stats.total_bytes)}")
     print(f"\n[OK] Результаты сохранены в: {tag_dir}")
     
     input("\nНажмите Enter для возврата в меню...")
@@ -840,7 +785,9 @@ def run_monitor_check():
     """Запустить проверку мониторинга"""
     import config
     from parser import ArhivachParser
-    from downloader import download_media_sync
+    from downloader import MediaDownloadSession
+    from crawlstate import open_state
+    from pipeline import process_thread, ThreadPipeline
     
     clear_screen()
     print_header()
@@ -859,103 +806,68 @@ def run_monitor_check():
     
     parser = ArhivachParser(domain=config.ARHIVACH_DOMAIN)
     
-    for item in active_items:
-        print(f"\n[*] Проверка: {item.name}")
-        
-        if item.item_type == 'thread':
-            # Проверяем тред
-            html_content, media_files, thread_date, thread_id, resource_files = parser.parse_thread(item.url)
+    # Одна сессия загрузки медиа и одна база состояния на всю проверку
+    with MediaDownloadSession() as downloader, open_state() as state:
+        for item in active_items:
+            print(f"\n[*] Проверка: {item.name}")
             
-            if html_content:
-                folder_name = parser.get_folder_name(thread_date, thread_id)
-                folder_name = sanitize_folder_name(folder_name)
-                thread_dir = os.path.join(config.OUTPUT_DIR, folder_name)
-                media_dir = os.path.join(thread_dir, 'media')
-                resources_dir = os.path.join(thread_dir, 'resources')
-                
-                os.makedirs(thread_dir, exist_ok=True)
-                os.makedirs(media_dir, exist_ok=True)
-                os.makedirs(resources_dir, exist_ok=True)
+            if item.item_type == 'thread':
+                # Проверяем тред
+                # Медиа качаются только из постов, появившихся после прошлой проверки
+                prepared, stats = process_thread(parser, item.url, config.OUTPUT_DIR, downloader, state,
+                                                 after_post=item.last_post_number)
                 
-                # Скачиваем ресурсы
-                for res in resource_files:
-                    res_path = os.path.join(resources_dir, res.filename)
-                    if not os.path.exists(res_path):
-                        parser.download_resource(res.url, res_path)
-                
-                # Сохраняем HTML
-                html_path = os.path.join(thread_dir, 'thread.html')
-                with open(html_path, 'w', encoding='utf-8') as f:
-                    f.write(html_content)
-                
-                # Загружаем новые медиа
-                if media_files:
-                    stats = download_media_sync(media_files, media_dir)
+                if prepared:
+                    if prepared.is_new:
+                        if item.last_post_number and prepared.new_posts:
+                            print(f"    [+] Новых постов: {prepared.new_posts}")
+                        item.last_posts_count = prepared.posts_count
+                        # При ошибках загрузки граница не сдвигается: медиа
+                        # этих постов будут выбраны снова при следующей проверке
+                        if stats.failed == 0:
+                            item.last_post_number = prepared.last_post_number or item.last_post_number
+                    
                     if stats.completed > 0:
                         print(f"    [+] Загружено {stats.completed} новых файлов")
-                    else:
+                    elif not prepared.is_new:
+                        print("    [=] Тред не изменился")
+                    elif prepared.media_files:
                         print("    [=] Нет новых файлов")
-                
-                item.last_check = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            else:
-                print("    [X] Ошибка загрузки")
-        
-        elif item.item_type == 'tag':
-            # Проверяем тег - загружаем первую страницу (offset=0)
-            threads, _ = parser.get_threads_from_tag_page(int(item.item_id), offset=0)
+                    
+                    item.last_check = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                else:
+                    print("    [X] Ошибка загрузки")
             
-            if threads:
-                # Создаем папку для тега
-                tag_dir = os.path.join(config.OUTPUT_DIR, f"tag_{item.item_id}")
-                os.makedirs(tag_dir, exist_ok=True)
+            elif item.item_type == 'tag':
+                # Проверяем тег - загружаем первую страницу (offset=0)
+                threads, _ = parser.get_threads_from_tag_page(int(item.item_id), offset=0)
                 
-                new_threads = 0
-                for thread in threads[:5]:  # Проверяем только последние 5 тредов
-                    html_content, media_files, thread_date, thread_id, resource_files = parser.parse_thread(thread.url)
+                if threads:
+                    # Создаем папку для тега
+                    tag_dir = os.path.join(config.OUTPUT_DIR, f"tag_{item.item_id}")
+                    os.makedirs(tag_dir, exist_ok=True)
                     
-                    if html_content:
-                        folder_name = parser.get_folder_name(thread_date, thread_id)
-                        folder_name = sanitize_folder_name(folder_name)
-                        thread_dir = os.path.join(tag_dir, folder_name)
-                        
-                        # Проверяем, новый ли это тред
-                        if not os.path.exists(thread_dir):
-                            new_threads += 1
-                            media_dir = os.path.join(thread_dir, 'media')
-                            resources_dir = os.path.join(thread_dir, 'resources')
-                            os.makedirs(thread_dir, exist_ok=True)
-                            os.makedirs(media_dir, exist_ok=True)
-                            os.makedirs(resources_dir, exist_ok=True)
-                            
-                            # Скачиваем ресурсы
-                            for res in resource_files:
-                                res_path = os.path.join(resources_dir, res.filename)
-                                parser.download_resource(res.url, res_path)
-                            
-                            html_path = os.path.join(thread_dir, 'thread.html')
-                            with open(html_path, 'w', encoding='utf-8') as f:
-                                f.write(html_content)
-                            
-                            if media_files:
-                                download_media_sync(media_files, media_dir)
+                    # Проверяем только последние 5 тредов, уже загруженные пропускаем
+                    pipeline = ThreadPipeline(parser, tag_dir, only_new=True, verbose=False,
+                                              downloader=downloader, state=state, tag_id=item.item_id)
+                    new_threads = pipeline.run(threads[:5]).new_threads
                     
-                    time.sleep(0.5)
-                
-                if new_threads > 0:
-                    print(f"    [+] Найдено {new_threads} новых тредов")
+                    if new_threads > 0:
+                        print(f"    [+] Найдено {new_threads} новых тредов")
+                    else:
+                        print("    [=] Нет новых тредов")
+                    
+                    item.last_check = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
                 else:
-                    print("    [=] Нет новых тредов")
-                
-                item.last_check = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            else:
-                print("    [X] Ошибка загрузки")
-        
-        time.sleep(config.PAGE_REQUEST_DELAY)
+                    print("    [X] Ошибка загрузки")
     
     # Сохраняем обновлённый список
     save_monitor_list(items)
     
     print_separator()
+    if parser.pages.not_modified:
+        print(f"\n[*] Страниц без изменений: {parser.pages.not_modified} "
+              f"(не загружено {format_bytes(parser.pages.saved_bytes)})")
     print("\n[OK] Проверка завершена")
     input("\nНажмите Enter для продолжения...")
 
@@ -1035,9 +947,29 @@ def show_args_help():
 
   --concurrent N, -c N
       Количество одновременных загрузок медиа (1-30)
-      По умолчанию: 5
+      При адаптивном подборе - верхний предел: при 429/5xx/таймаутах
+      число загрузок снижается, но выше N не поднимается
+      По умолчанию: 5 (с подбором до 30)
       Пример: python main.py --thread URL --concurrent 10
 
+  --sync, -s
+      Синхронизация тега (только с --tag): страницы просматриваются от новых
+      тредов к старым, обход прекращается на серии уже загруженных тредов
+      (см. SYNC_STOP_AFTER_KNOWN в config.py)
+      Пример: python main.py --tag 14905 --sync
+
+  --convert [DIR]
+      Конвертировать PNG/WebP/BMP в уже загруженных тредах в JPG (на всех
+      ядрах) и обновить ссылки в thread.html. Файлы, которые в JPG стали бы
+      больше, не меняются. Прерванную конвертацию можно запустить снова.
+      По умолчанию: папка --output
+      Пример: python main.py --convert downloads/tag_14905
+
+  --defer-convert
+      Не конвертировать изображения во время загрузки (--thread/--tag),
+      а сконвертировать их одним проходом после неё
+      Пример: python main.py --tag 14905 --defer-convert
+
   --help-args
       Показать эту справку
 
@@ -1135,8 +1067,9 @@ def parse_command_line():
     """Обработка аргументов командной строки"""
     import argparse
     import config
-    from parser import ArhivachParser
-    from downloader import download_media_sync
+    from parser import ArhivachParser, get_all_threads_from_tag_concurrent
+    from crawlstate import CrawlState, open_state
+    from pipeline import is_thread_archived, process_thread, ThreadPipeline
     
     parser = argparse.ArgumentParser(
         description='twst.downloader - Модуль загрузки тредов',
@@ -1146,11 +1079,14 @@ def parse_command_line():
     group = parser.add_mutually_exclusive_group()
     group.add_argument('--thread', '-t', metavar='URL')
     group.add_argument('--tag', '-g', metavar='TAG_ID')
+    group.add_argument('--convert', nargs='?', const='', metavar='DIR')
     
     parser.add_argument('--output', '-o', metavar='DIR', default=config.OUTPUT_DIR)
     parser.add_argument('--max-pages', '-p', type=int, metavar='N')
     parser.add_argument('--domain', '-d', metavar='URL', default=config.ARHIVACH_DOMAIN)
-    parser.add_argument('--concurrent', '-c', type=int, metavar='N', default=config.MAX_CONCURRENT_DOWNLOADS)
+    parser.add_argument('--concurrent', '-c', type=int, metavar='N')
+    parser.add_argument('--sync', '-s', action='store_true')
+    parser.add_argument('--defer-convert', action='store_true')
     parser.add_argument('--help-args', action='store_true')
     
     args = parser.parse_args()
@@ -1159,50 +1095,54 @@ def parse_command_line():
         show_args_help()
         sys.exit(0)
     
+    if args.convert is not None:
+        if not ensure_dependencies():
+            sys.exit(1)
+        
+        config.OUTPUT_DIR = args.output
+        convert_dir = args.convert or args.output
+        if not os.path.isdir(convert_dir):
+            print(f"[X] Папка не найдена: {convert_dir}")
+            sys.exit(1)
+        
+        from mediaconvert import convert_archive
+        print(f"\n[*] Конвертация медиа в JPG: {convert_dir}")
+        print(f"\n{convert_archive(convert_dir)}")
+        sys.exit(0)
+    
     if args.thread or args.tag:
         # Проверяем зависимости
         if not ensure_dependencies():
             sys.exit(1)
         
-        config.MAX_CONCURRENT_DOWNLOADS = min(30, max(1, args.concurrent))
+        if args.concurrent is not None:
+            set_max_concurrent(min(30, max(1, args.concurrent)))
         config.ARHIVACH_DOMAIN = args.domain
         config.OUTPUT_DIR = args.output
         
+        # Отложенная конвертация: медиа качаются как есть, JPG - после загрузки
+        defer_convert = args.defer_convert and config.CONVERT_IMAGES_TO_JPG
+        if defer_convert:
+            config.CONVERT_IMAGES_TO_JPG = False
+        result_dir = args.output
+        
         arhivach_parser = ArhivachParser(domain=args.domain)
         os.makedirs(args.output, exist_ok=True)
         
         if args.thread:
             print(f"\n[*] Загрузка треда: {args.thread}")
-            html_content, media_files, thread_date, thread_id, resource_files = arhivach_parser.parse_thread(args.thread)
+            with open_state() as state:
+                prepared, stats = process_thread(arhivach_parser, args.thread, args.output, state=state)
             
-            if not html_content:
+            if prepared is None:
                 print("[X] Ошибка: не удалось загрузить тред")
                 sys.exit(1)
             
-            folder_name = arhivach_parser.get_folder_name(thread_date, thread_id)
-            folder_name = sanitize_folder_name(folder_name)
-            thread_dir = os.path.join(args.output, folder_name)
-            media_dir = os.path.join(thread_dir, 'media')
-            resources_dir = os.path.join(thread_dir, 'resources')
-            
-            os.makedirs(thread_dir, exist_ok=True)
-            os.makedirs(media_dir, exist_ok=True)
-            os.makedirs(resources_dir, exist_ok=True)
-            
-            # Скачиваем ресурсы
-            for res in resource_files:
-                res_path = os.path.join(resources_dir, res.filename)
-                arhivach_parser.download_resource(res.url, res_path)
-            
-            html_path = os.path.join(thread_dir, 'thread.html')
-            with open(html_path, 'w', encoding='utf-8') as f:
-                f.write(html_content)
-            
-            if media_files:
-                stats = download_media_sync(media_files, media_dir)
+            if prepared.media_files:
                 print(f"\n{stats}")
             
-            print(f"\n[OK] Тред сохранён в: {thread_dir}")
+            print(f"\n[OK] Тред сохранён в: {prepared.thread_dir}")
+            result_dir = prepared.thread_dir
         
         elif args.tag:
             tag_id = None
@@ -1217,56 +1157,47 @@ def parse_command_line():
                 print(f"[X] Не удалось определить ID тега из '{args.tag}'")
                 sys.exit(1)
             
-            print(f"\n[*] Загрузка тредов по тегу: {tag_id}")
-            threads = arhivach_parser.get_all_threads_from_tag(tag_id, args.max_pages)
-            
-            if not threads:
-                print("[X] Треды не найдены")
-                sys.exit(1)
-            
             tag_dir = os.path.join(args.output, f"tag_{tag_id}")
-            os.makedirs(tag_dir, exist_ok=True)
             
-            successful = 0
-            for i, thread in enumerate(threads, 1):
-                print(f"\n[{i}/{len(threads)}] {thread.title[:50]}...")
-                
-                try:
-                    html_content, media_files, thread_date, thread_id, resource_files = arhivach_parser.parse_thread(thread.url)
+            if args.sync and config.CRAWL_STATE_ENABLED:
+                print(f"\n[*] Синхронизация тредов по тегу: {tag_id}")
+                with CrawlState() as state:
+                    threads = arhivach_parser.sync_threads_from_tag(
+                        tag_id, lambda thread: is_thread_archived(state, thread, tag_dir),
+                        max_pages=args.max_pages
+                    )
+                    if not threads:
+                        print("[OK] Новых и обновлённых тредов нет")
+                        sys.exit(0)
                     
-                    if html_content:
-                        folder_name = arhivach_parser.get_folder_name(thread_date, thread_id)
-                        folder_name = sanitize_folder_name(folder_name)
-                        thread_dir = os.path.join(tag_dir, folder_name)
-                        media_dir = os.path.join(thread_dir, 'media')
-                        resources_dir = os.path.join(thread_dir, 'resources')
-                        
-                        os.makedirs(thread_dir, exist_ok=True)
-                        os.makedirs(media_dir, exist_ok=True)
-                        os.makedirs(resources_dir, exist_ok=True)
-                        
-                        # Скачиваем ресурсы
-                        for res in resource_files:
-                            res_path = os.path.join(resources_dir, res.filename)
-                            arhivach_parser.download_resource(res.url, res_path)
-                        
-                        html_path = os.path.join(thread_dir, 'thread.html')
-                        with open(html_path, 'w', encoding='utf-8') as f:
-                            f.write(html_content)
-                        
-                        if media_files:
-                            download_media_sync(media_files, media_dir)
-                        
-                        successful += 1
+                    os.makedirs(tag_dir, exist_ok=True)
+                    crawl_stats = ThreadPipeline(arhivach_parser, tag_dir, state=state, tag_id=tag_id).run(threads)
+            else:
+                if args.sync:
+                    print("[!] База состояния отключена (CRAWL_STATE_ENABLED), --sync недоступен")
+                
+                print(f"\n[*] Загрузка тредов по тегу: {tag_id}")
+                threads = get_all_threads_from_tag_concurrent(tag_id, args.max_pages, args.domain)
                 
-                except Exception as e:
-                    print(f"  [X] Ошибка: {e}")
+                if not threads:
+                    print("[X] Треды не найдены")
+                    sys.exit(1)
                 
-                if i < len(threads):
-                    time.sleep(config.PAGE_REQUEST_DELAY)
+                os.makedirs(tag_dir, exist_ok=True)
+                crawl_stats = ThreadPipeline(arhivach_parser, tag_dir, tag_id=tag_id).run(threads)
             
-            print(f"\n[OK] Загружено: {successful}/{len(threads)} тредов")
+            print(f"\n[OK] Загружено: {crawl_stats.successful}/{len(threads)} тредов")
+            if arhivach_parser.pages.not_modified:
+                print(f"[OK] Страниц без изменений: {arhivach_parser.pages.not_modified} "
+                      f"(не загружено {format_bytes(arhivach_parser.pages.saved_bytes)})")
             print(f"[OK] Результаты: {tag_dir}")
+            result_dir = tag_dir
+        
+        if defer_convert:
+            from mediaconvert import convert_archive
+            config.CONVERT_IMAGES_TO_JPG = True
+            print("\n[*] Конвертация загруженных медиа в JPG...")
+            print(f"\n{convert_archive(result_dir)}")
         
         sys.exit(0)
     
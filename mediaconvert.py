@@ -0,0 +1,341 @@
+"""
+Модуль отложенной конвертации загруженных медиа в JPG
+
+Проходит по папкам media/ уже сохранённых тредов, конвертирует PNG/WebP/BMP
+в JPG параллельно на всех ядрах и переписывает ссылки в thread.html и
+posts.jsonl. Файл, который в JPG получился бы больше, остаётся как есть.
+
+Проход можно прервать и запустить снова: сначала рядом с оригиналами
+создаются JPG, затем переписываются ссылки и только после этого удаляются
+оригиналы. Уже сделанная работа при повторном запуске не повторяется.
+"""
+
+import os
+import re
+import json
+import multiprocessing
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from dataclasses import dataclass, field
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from tqdm import tqdm
+
+import config
+from parser import MediaManifest, Post
+from crawlstate import CrawlState
+from downloader import CONVERTIBLE_EXTENSIONS, convert_image_file_to_jpg, get_jpg_filename
+from mediastore import MediaStore
+from pipeline import MEDIA_MANIFEST_NAME, POSTS_FILE_NAME, rewrite_media_links
+
+
+# Файлы, для которых JPG оказался больше оригинала: {имя: {size, quality}}
+KEPT_FILE_NAME = '.jpg_kept.json'
+
+# ID треда в конце имени папки: ДД.ММ.ГГ_ID или thread_ID
+FOLDER_THREAD_ID_RE = re.compile(r'_(\d+)$')
+
+
+@dataclass
+class ConvertStats:
+    """Статистика отложенной конвертации"""
+    threads: int = 0
+    converted: int = 0
+    kept: int = 0
+    failed: int = 0
+    saved_bytes: int = 0
+    updated_pages: int = 0
+    errors: List[str] = field(default_factory=list)
+
+    def __str__(self):
+        result = (
+            f"Статистика конвертации:\n"
+            f"  Тредов: {self.threads}\n"
+            f"  Конвертировано в JPG: {self.converted}\n"
+            f"  Оставлено без изменений (JPG больше): {self.kept}\n"
+            f"  Ошибок: {self.failed}\n"
+            f"  Обновлено страниц: {self.updated_pages}\n"
+            f"  Освобождено: {self.saved_bytes / 1024 / 1024:.2f} МБ"
+        )
+        for error in self.errors[:10]:
+            result += f"\n  [X] {error}"
+        return result
+
+
+@dataclass
+class _ThreadJob:
+    """Конвертация медиа одного треда"""
+    thread_dir: str
+    media_dir: str
+    kept: Dict[str, dict]
+    # Оригинал -> JPG для файлов, у которых JPG уже готов
+    renames: Dict[str, str] = field(default_factory=dict)
+    # Оригинала уже нет, а страница всё ещё ссылается на него (перезаписана
+    # повторным обходом без конвертации)
+    relinks: Dict[str, str] = field(default_factory=dict)
+    pending: int = 0
+
+
+def _convert_job(src_path: str, dst_path: str, quality: int) -> Tuple[bool, int]:
+    """
+    Конвертировать один файл (выполняется в процессе пула)
+
+    Returns:
+        (успех, размер JPG)
+    """
+    if not convert_image_file_to_jpg(src_path, dst_path, quality):
+        return False, 0
+    return True, os.path.getsize(dst_path)
+
+
+def find_thread_dirs(root: str) -> Iterator[str]:
+    """Папки сохранённых тредов (с thread.html и media/) внутри root"""
+    for current, dirs, files in os.walk(root):
+        # Служебные папки (.media_store, .pages, ...) пропускаем
+        dirs[:] = sorted(d for d in dirs if not d.startswith('.') and d != 'media' and d != 'resources')
+        if 'thread.html' in files and os.path.isdir(os.path.join(current, 'media')):
+            yield current
+
+
+def _load_kept(media_dir: str) -> Dict[str, dict]:
+    try:
+        with open(os.path.join(media_dir, KEPT_FILE_NAME), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_kept(media_dir: str, kept: Dict[str, dict]):
+    path = os.path.join(media_dir, KEPT_FILE_NAME)
+    if not kept:
+        if os.path.exists(path):
+            os.remove(path)
+        return
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(kept, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+def _rewrite_links(path: str, renames: Dict[str, str]) -> bool:
+    """
+    Заменить ссылки media/ORIGINAL на media/JPG в текстовом файле
+
+    Returns:
+        True если файл изменён
+    """
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            text = f.read()
+    except OSError:
+        return False
+
+    new_text = rewrite_media_links(text, renames)
+    if new_text == text:
+        return False
+
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(new_text)
+    os.replace(tmp_path, path)
+    return True
+
+
+class MediaConverter:
+    """
+    Отложенная конвертация медиа в сохранённых тредах
+
+    Пример:
+        stats = MediaConverter().run('downloads/tag_14905')
+    """
+
+    def __init__(self, workers: int = None, quality: int = None, state: CrawlState = None):
+        """
+        Args:
+            workers: Процессов конвертации (None = все ядра)
+            quality: Качество JPG (None = config.JPG_QUALITY)
+            state: База состояния, в которой обновляются вложения постов
+        """
+        self.workers = max(1, workers or os.cpu_count() or 1)
+        self.quality = quality or config.JPG_QUALITY
+        self.state = state
+        self.store = MediaStore() if config.MEDIA_STORE_ENABLED else None
+        self.stats = ConvertStats()
+
+    def _plan_thread(self, thread_dir: str) -> Tuple[_ThreadJob, List[str]]:
+        """Определить, какие файлы треда нужно конвертировать"""
+        media_dir = os.path.join(thread_dir, 'media')
+        job = _ThreadJob(thread_dir=thread_dir, media_dir=media_dir, kept=_load_kept(media_dir))
+        names = set(os.listdir(media_dir))
+        to_convert = []
+        for name in sorted(names):
+            if os.path.splitext(name)[1].lower() not in CONVERTIBLE_EXTENSIONS:
+                continue
+            jpg_name = get_jpg_filename(name)
+            if jpg_name in names:
+                # JPG уже создан прошлым запуском: осталось переписать ссылки
+                job.renames[name] = jpg_name
+                continue
+            kept = job.kept.get(name)
+            if (kept and kept.get('quality') == self.quality
+                    and kept.get('size') == os.path.getsize(os.path.join(media_dir, name))):
+                continue
+            to_convert.append(name)
+
+        manifest = MediaManifest.load(os.path.join(thread_dir, MEDIA_MANIFEST_NAME))
+        for name in manifest.by_filename:
+            jpg_name = get_jpg_filename(name)
+            if name not in names and jpg_name != name and jpg_name in names:
+                job.relinks[name] = jpg_name
+        return job, to_convert
+
+    def _on_converted(self, job: _ThreadJob, name: str, ok: bool, jpg_size: int):
+        """Обработать результат конвертации одного файла"""
+        src_path = os.path.join(job.media_dir, name)
+        jpg_name = get_jpg_filename(name)
+        tmp_path = os.path.join(job.media_dir, jpg_name + '.tmp')
+        size = os.path.getsize(src_path)
+
+        if not ok:
+            self.stats.failed += 1
+            self.stats.errors.append(f"{src_path}: не удалось конвертировать")
+        elif jpg_size >= size:
+            os.remove(tmp_path)
+            job.kept[name] = {'size': size, 'quality': self.quality}
+            self.stats.kept += 1
+        else:
+            jpg_path = os.path.join(job.media_dir, jpg_name)
+            os.replace(tmp_path, jpg_path)
+            if self.store is not None:
+                self.store.add(jpg_path, jpg_name)
+            job.kept.pop(name, None)
+            job.renames[name] = jpg_name
+            self.stats.converted += 1
+            self.stats.saved_bytes += size - jpg_size
+
+    def _finish_thread(self, job: _ThreadJob):
+        """Переписать ссылки треда и удалить сконвертированные оригиналы"""
+        try:
+            self._apply_renames(job)
+        except OSError as e:
+            # Оригиналы остались на месте: следующий запуск доделает тред
+            self.stats.errors.append(f"{job.thread_dir}: {e}")
+
+    def _apply_renames(self, job: _ThreadJob):
+        """Заменить ссылки в thread.html и posts.jsonl, затем удалить оригиналы"""
+        links = {**job.relinks, **job.renames}
+        if links:
+            updated = _rewrite_links(os.path.join(job.thread_dir, 'thread.html'), links)
+            posts_path = os.path.join(job.thread_dir, POSTS_FILE_NAME)
+            if _rewrite_links(posts_path, links):
+                updated = True
+            # Базу обновляем и при повторном запуске: прошлый мог прерваться до неё
+            if job.renames or updated:
+                self._update_state(job, posts_path, links)
+            if updated:
+                self.stats.updated_pages += 1
+
+            # Оригиналы удаляются только после того, как на них не осталось ссылок
+            for name in job.renames:
+                path = os.path.join(job.media_dir, name)
+                if os.path.exists(path):
+                    os.remove(path)
+        _save_kept(job.media_dir, job.kept)
+
+    def _update_state(self, job: _ThreadJob, posts_path: str, links: Dict[str, str]):
+        """Обновить вложения постов и размеры сконвертированных файлов в базе состояния"""
+        match = FOLDER_THREAD_ID_RE.search(os.path.basename(job.thread_dir))
+        if self.state is None or not match:
+            return
+        thread_id = match.group(1)
+
+        # По размеру загрузчик проверяет целостность уже загруженных файлов
+        for name, jpg_name in links.items():
+            self.state.update_media_size(thread_id, name, os.path.getsize(os.path.join(job.media_dir, jpg_name)))
+
+        if os.path.isfile(posts_path):
+            with open(posts_path, 'r', encoding='utf-8') as f:
+                posts = [Post(**json.loads(line)) for line in f if line.strip()]
+            self.state.save_posts(thread_id, posts)
+
+    def run(self, root: str) -> ConvertStats:
+        """
+        Конвертировать медиа во всех тредах внутри root
+
+        Args:
+            root: Папка треда, тега или всех загрузок
+
+        Returns:
+            Статистика конвертации
+        """
+        self.stats = ConvertStats()
+        jobs: List[Tuple[_ThreadJob, str]] = []
+        ready: List[_ThreadJob] = []
+        for thread_dir in find_thread_dirs(root):
+            self.stats.threads += 1
+            job, names = self._plan_thread(thread_dir)
+            job.pending = len(names)
+            jobs.extend((job, name) for name in names)
+            if not names:
+                ready.append(job)
+
+        # Треды, где конвертировать нечего, но остались ссылки от прерванного запуска
+        for job in ready:
+            self._finish_thread(job)
+
+        if not jobs:
+            return self.stats
+
+        # В работе держим ограниченное число задач, чтобы не создавать
+        # по future на каждый файл архива
+        window = self.workers * 4
+        queued = iter(jobs)
+        in_flight = {}
+        # spawn - как и у остальных пулов программы
+        executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context('spawn'))
+        with executor, \
+                tqdm(total=len(jobs), desc="Конвертация", unit="файл") as pbar:
+            while True:
+                while len(in_flight) < window:
+                    item = next(queued, None)
+                    if item is None:
+                        break
+                    job, name = item
+                    src_path = os.path.join(job.media_dir, name)
+                    dst_path = os.path.join(job.media_dir, get_jpg_filename(name) + '.tmp')
+                    in_flight[executor.submit(_convert_job, src_path, dst_path, self.quality)] = item
+                if not in_flight:
+                    break
+
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    job, name = in_flight.pop(future)
+                    try:
+                        ok, jpg_size = future.result()
+                        self._on_converted(job, name, ok, jpg_size)
+                    except Exception as e:
+                        self.stats.failed += 1
+                        self.stats.errors.append(f"{os.path.join(job.media_dir, name)}: {e}")
+                    pbar.update(1)
+
+                    job.pending -= 1
+                    if job.pending == 0:
+                        self._finish_thread(job)
+
+        return self.stats
+
+
+def convert_archive(root: str, workers: int = None, quality: int = None) -> ConvertStats:
+    """
+    Конвертировать медиа во всех сохранённых тредах внутри root
+
+    Открывает базу состояния (если она включена), чтобы обновить
+    вложения постов вместе с posts.jsonl.
+    """
+    state: Optional[CrawlState] = None
+    if config.CRAWL_STATE_ENABLED:
+        state = CrawlState()
+    try:
+        return MediaConverter(workers, quality, state).run(root)
+    finally:
+        if state is not None:
+            state.close()
@@ -0,0 +1,115 @@
+"""
+Модуль общего хранилища медиа-файлов
+
+Имена файлов на Архиваче - это хеши содержимого (/storage/X/XX/HASH.ext),
+поэтому один и тот же файл из разных тредов и тегов хранится один раз,
+а в папки тредов попадает жёсткой ссылкой.
+"""
+
+import os
+import shutil
+from typing import Optional
+
+import config
+
+
+def link_file(src: str, dst: str) -> str:
+    """
+    Создать dst, указывающий на src
+
+    Сначала пробует жёсткую ссылку, затем символическую, затем копирование.
+
+    Returns:
+        Способ: 'hardlink', 'symlink' или 'copy'
+    """
+    os.makedirs(os.path.dirname(dst) or '.', exist_ok=True)
+    if os.path.lexists(dst):
+        os.remove(dst)
+
+    try:
+        os.link(src, dst)
+        return 'hardlink'
+    except OSError:
+        pass
+
+    try:
+        os.symlink(os.path.abspath(src), dst)
+        return 'symlink'
+    except (OSError, NotImplementedError):
+        pass
+
+    shutil.copy2(src, dst)
+    return 'copy'
+
+
+class MediaStore:
+    """
+    Хранилище медиа с адресацией по содержимому
+
+    Ключ - имя файла (хеш + расширение) в том виде, в каком он лежит
+    в папке треда, т.е. уже после конвертации в JPG. Файлы раскладываются
+    по подпапкам по первым двум символам имени.
+    """
+
+    def __init__(self, root: str = None):
+        self.root = root or config.MEDIA_STORE_DIR or os.path.join(config.OUTPUT_DIR, '.media_store')
+        # Сообщение о недоступных жёстких ссылках выводится один раз
+        self.link_warned = False
+
+    def path_for(self, filename: str) -> str:
+        """Путь к файлу в хранилище"""
+        return os.path.join(self.root, filename[:2].lower(), filename)
+
+    def lookup(self, filename: str) -> Optional[str]:
+        """Найти файл в хранилище"""
+        path = self.path_for(filename)
+        return path if os.path.isfile(path) else None
+
+    def add(self, filepath: str, filename: str = None) -> Optional[str]:
+        """
+        Добавить загруженный файл в хранилище
+
+        Файл добавляется только жёсткой ссылкой: копия удвоила бы место
+        на диске, а символическая ссылка зависела бы от папки треда.
+        Если файловая система не поддерживает жёсткие ссылки, файл
+        в хранилище не попадает.
+
+        Args:
+            filepath: Путь к загруженному файлу (в папке треда)
+            filename: Ключ в хранилище (по умолчанию - имя файла)
+
+        Returns:
+            Путь в хранилище или None, если добавить не удалось
+        """
+        store_path = self.path_for(filename or os.path.basename(filepath))
+        # Символическая ссылка в папку треда (от прежних версий) заменяется
+        if os.path.isfile(store_path) and not os.path.islink(store_path):
+            return store_path
+        try:
+            os.makedirs(os.path.dirname(store_path), exist_ok=True)
+            if os.path.lexists(store_path):
+                os.remove(store_path)
+            os.link(filepath, store_path)
+            return store_path
+        except OSError as e:
+            if not self.link_warned:
+                self.link_warned = True
+                print(f"[!] Общее хранилище: не удалось создать жёсткую ссылку ({e}), "
+                      f"файлы не добавляются в {self.root}")
+            return None
+
+    def materialize(self, filename: str, dest_path: str) -> Optional[str]:
+        """
+        Разместить файл из хранилища в папке треда
+
+        Returns:
+            Способ размещения ('hardlink', 'symlink', 'copy') или None,
+            если файла нет в хранилище
+        """
+        store_path = self.lookup(filename)
+        if store_path is None:
+            return None
+        try:
+            return link_file(store_path, dest_path)
+        except OSError:
+            return None
@@ -0,0 +1,148 @@
+"""
+Модуль условных запросов к страницам
+
+Хранит ETag/Last-Modified страниц тредов и тегов между запусками, чтобы
+повторная проверка отправляла If-None-Match/If-Modified-Since и при ответе
+304 Not Modified не скачивала и не разбирала страницу заново.
+
+На каждый URL - отдельный небольшой файл, поэтому запись валидаторов
+одной страницы не зависит от того, сколько страниц уже известно.
+"""
+
+import os
+import json
+import hashlib
+import threading
+from typing import Dict, Optional
+
+import config
+
+
+class PageCache:
+    """
+    Валидаторы страниц с ключом по URL
+
+    Для страниц тегов дополнительно хранится тело ответа: при 304 список
+    тредов разбирается из сохранённой копии. Для тредов тело не нужно -
+    при 304 страница на диске уже актуальна.
+    """
+
+    def __init__(self, root: str = None):
+        self.root = root or config.PAGE_CACHE_DIR or os.path.join(config.OUTPUT_DIR, '.pages')
+        self.lock = threading.Lock()
+        # Сколько запросов закончились 304 и сколько байт не пришлось качать
+        self.not_modified = 0
+        self.saved_bytes = 0
+        self._migrate_index()
+
+    def _migrate_index(self):
+        """Разложить общий index.json прежних версий по файлам страниц"""
+        index_path = os.path.join(self.root, 'index.json')
+        try:
+            with open(index_path, 'r', encoding='utf-8') as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            return
+        for url, entry in index.items():
+            with open(self._entry_path(url), 'w', encoding='utf-8') as f:
+                json.dump(dict(entry, url=url), f, ensure_ascii=False)
+        os.remove(index_path)
+
+    def _key(self, url: str) -> str:
+        return os.path.join(self.root, hashlib.md5(url.encode()).hexdigest())
+
+    def _entry_path(self, url: str) -> str:
+        """Путь к файлу валидаторов страницы"""
+        return self._key(url) + '.json'
+
+    def _body_path(self, url: str) -> str:
+        """Путь к сохранённому телу страницы"""
+        return self._key(url) + '.html'
+
+    def _load_entry(self, url: str) -> Optional[dict]:
+        try:
+            with open(self._entry_path(url), 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        # Защита от коллизии имени файла
+        return entry if entry.get('url') == url else None
+
+    def headers(self, url: str, need_body: bool = False) -> Dict[str, str]:
+        """
+        Заголовки условного запроса для url
+
+        Args:
+            url: URL страницы
+            need_body: При 304 нужно тело страницы (без сохранённой копии
+                условный запрос не отправляется)
+        """
+        entry = self._load_entry(url)
+        if not entry:
+            return {}
+        if need_body and not os.path.isfile(self._body_path(url)):
+            return {}
+
+        headers = {}
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def update(self, url: str, etag: Optional[str], last_modified: Optional[str],
+               content: bytes, keep_body: bool = False):
+        """
+        Запомнить валидаторы полученной страницы
+
+        Args:
+            url: URL страницы
+            etag: Заголовок ETag ответа
+            last_modified: Заголовок Last-Modified ответа
+            content: Тело ответа
+            keep_body: Сохранить тело для разбора при следующем 304
+        """
+        entry_path = self._entry_path(url)
+        if not etag and not last_modified:
+            # Сервер не поддерживает условные запросы для этой страницы
+            if os.path.exists(entry_path):
+                os.remove(entry_path)
+            return
+
+        os.makedirs(self.root, exist_ok=True)
+        suffix = f".{threading.get_ident()}.tmp"
+        if keep_body:
+            body_path = self._body_path(url)
+            with open(body_path + suffix, 'wb') as f:
+                f.write(content)
+            os.replace(body_path + suffix, body_path)
+
+        entry = {
+            'url': url,
+            'etag': etag,
+            'last_modified': last_modified,
+            'size': len(content)
+        }
+        with open(entry_path + suffix, 'w', encoding='utf-8') as f:
+            json.dump(entry, f, ensure_ascii=False)
+        os.replace(entry_path + suffix, entry_path)
+
+    def hit(self, url: str, need_body: bool = False) -> Optional[bytes]:
+        """
+        Учесть ответ 304 для url
+
+        Returns:
+            Сохранённое тело страницы (если need_body) или b''
+        """
+        entry = self._load_entry(url) or {}
+        with self.lock:
+            self.not_modified += 1
+            self.saved_bytes += entry.get('size', 0)
+
+        if not need_body:
+            return b''
+        try:
+            with open(self._body_path(url), 'rb') as f:
+                return f.read()
+        except OSError:
+            return None
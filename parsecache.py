@@ -0,0 +1,80 @@
+"""
+Модуль кеша результатов разбора тредов
+
+Ключ - SHA-256 от сырого HTML страницы, URL треда и настроек, влияющих
+на разбор. Если страница пришла байт в байт такой же, как в прошлый раз,
+результат (переписанный HTML, медиа, ресурсы, посты) берётся из кеша
+вместо полного разбора.
+
+На каждый URL хранится одна запись: новая версия страницы заменяет старую,
+поэтому кеш не растёт при повторных проверках.
+"""
+
+import os
+import json
+import hashlib
+import threading
+from typing import Dict, Optional
+
+import config
+
+
+def page_digest(content: bytes, thread_url: str, settings: Dict[str, object]) -> str:
+    """Ключ кеша для страницы"""
+    digest = hashlib.sha256()
+    digest.update(json.dumps(settings, sort_keys=True, ensure_ascii=False).encode())
+    digest.update(b'\0' + thread_url.encode() + b'\0')
+    digest.update(content)
+    return digest.hexdigest()
+
+
+class ParseCache:
+    """Кеш результатов разбора с одной записью на URL"""
+
+    def __init__(self, root: str = None):
+        # Без явной папки путь берётся из config при каждом обращении
+        self._root = root
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def root(self) -> str:
+        return self._root or config.PARSE_CACHE_DIR or os.path.join(config.OUTPUT_DIR, '.parse_cache')
+
+    def _entry_path(self, url: str) -> str:
+        return os.path.join(self.root, hashlib.md5(url.encode()).hexdigest() + '.json')
+
+    def get(self, url: str, digest: str) -> Optional[dict]:
+        """
+        Получить сохранённый результат разбора
+
+        Returns:
+            Словарь результата или None, если страница изменилась или записи нет
+        """
+        try:
+            with open(self._entry_path(url), 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            entry = None
+
+        with self.lock:
+            if entry is None or entry.get('digest') != digest:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return entry['page']
+
+    def put(self, url: str, digest: str, page: dict):
+        """Сохранить результат разбора (заменяет прежнюю запись для url)"""
+        path = self._entry_path(url)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({'digest': digest, 'page': page}, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except OSError:
+            # Кеш необязателен: ошибка записи не должна ломать загрузку
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
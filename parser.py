@@ -3,16 +3,27 @@
 """
 
 import re
+import itertools
 import os
-import time
+import json
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 from urllib.parse import urljoin, urlparse
-from typing import List, Optional, Tuple
-from dataclasses import dataclass
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+from dataclasses import asdict, dataclass, field
 
+import aiohttp
 import requests
-from bs4 import BeautifulSoup
+import lxml.etree
+import lxml.html
+from bs4 import BeautifulSoup, Comment, NavigableString, Tag
 
 import config
+from ratelimit import rate_limiter
+from resourcecache import ResourceCache
+from pagecache import PageCache
+from parsecache import ParseCache, page_digest
 
 
 @dataclass
@@ -22,6 +33,7 @@ class ThreadInfo:
     title: str
     date: str
     thread_id: str = ""
+    # Количество постов по списку тега (0 = неизвестно)
     posts_count: int = 0
 
 
@@ -33,6 +45,80 @@ class MediaFile:
     file_type: str  # 'image', 'video', 'other'
 
 
+class MediaManifest:
+    """
+    Список медиа-файлов треда без повторов
+    
+    Сохраняет порядок добавления и ищет файлы по URL, имени файла
+    и хешу (имя без расширения) за O(1). Повторное добавление URL
+    игнорируется.
+    """
+    
+    def __init__(self, media_files: Iterable[MediaFile] = ()):
+        self.files: List[MediaFile] = []
+        self.by_url: Dict[str, MediaFile] = {}
+        self.by_filename: Dict[str, MediaFile] = {}
+        self.by_hash: Dict[str, MediaFile] = {}
+        for media in media_files:
+            self.add(media)
+    
+    @staticmethod
+    def file_hash(filename: str) -> str:
+        """Хеш файла - имя без расширения (/storage/X/XX/HASH.ext)"""
+        return filename.split('.', 1)[0]
+    
+    def add(self, media: MediaFile) -> bool:
+        """
+        Добавить файл
+        
+        Returns:
+            False если файл с таким URL уже есть
+        """
+        if media.url in self.by_url:
+            return False
+        self.files.append(media)
+        self.by_url[media.url] = media
+        # По имени и хешу запоминаем первый файл, как при поиске перебором
+        self.by_filename.setdefault(media.filename, media)
+        self.by_hash.setdefault(self.file_hash(media.filename), media)
+        return True
+    
+    def has_url(self, url: str) -> bool:
+        return url in self.by_url
+    
+    def has_filename(self, filename: str) -> bool:
+        return filename in self.by_filename
+    
+    def get_by_hash(self, file_hash: str) -> Optional[MediaFile]:
+        """Файл с этим хешем, в том числе под именем после конвертации в JPG"""
+        return self.by_hash.get(file_hash)
+    
+    def __iter__(self) -> Iterator[MediaFile]:
+        return iter(self.files)
+    
+    def __len__(self) -> int:
+        return len(self.files)
+    
+    def __getitem__(self, index):
+        return self.files[index]
+    
+    def save(self, path: str):
+        """Сохранить список в JSON"""
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump([asdict(m) for m in self.files], f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, path)
+    
+    @classmethod
+    def load(cls, path: str) -> 'MediaManifest':
+        """Загрузить список из JSON (пустой, если файла нет или он повреждён)"""
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return cls(MediaFile(**item) for item in json.load(f))
+        except (OSError, ValueError, TypeError):
+            return cls()
+
+
 @dataclass
 class ResourceFile:
     """Информация о ресурсном файле (CSS, JS)"""
@@ -41,9 +127,222 @@ class ResourceFile:
     resource_type: str  # 'css', 'js'
 
 
+@dataclass
+class Post:
+    """Пост треда"""
+    number: str
+    time: str = ""  # как на странице: "20/01/25 Пнд 16:33:14"
+    posted_at: str = ""  # "2025-01-20 16:33:14" (пусто, если время не распознано)
+    subject: str = ""
+    text: str = ""
+    attachments: List[str] = field(default_factory=list)  # имена файлов в media/
+
+
+@dataclass
+class ThreadPage:
+    """Результат парсинга треда"""
+    url: str
+    html_content: Optional[str] = None
+    media_files: MediaManifest = field(default_factory=MediaManifest)
+    resource_files: List[ResourceFile] = field(default_factory=list)
+    thread_date: str = ""
+    thread_id: str = ""
+    posts_count: int = 0
+    # Сервер ответил 304: сохранённая копия треда актуальна, разбор не выполнялся
+    not_modified: bool = False
+    posts: List[Post] = field(default_factory=list)
+    
+    def as_tuple(self) -> Tuple[Optional[str], List[MediaFile], str, str, List[ResourceFile]]:
+        """Результат в формате ArhivachParser.parse_thread"""
+        return self.html_content, list(self.media_files), self.thread_date, self.thread_id, self.resource_files
+    
+    def to_dict(self) -> dict:
+        """Результат в виде словаря для JSON"""
+        return {
+            'url': self.url,
+            'html_content': self.html_content,
+            'media_files': [asdict(m) for m in self.media_files],
+            'resource_files': [asdict(r) for r in self.resource_files],
+            'thread_date': self.thread_date,
+            'thread_id': self.thread_id,
+            'posts_count': self.posts_count,
+            'posts': [asdict(p) for p in self.posts]
+        }
+    
+    @classmethod
+    def from_dict(cls, data: dict) -> 'ThreadPage':
+        """Восстановить результат из словаря to_dict"""
+        return cls(
+            url=data['url'],
+            html_content=data['html_content'],
+            media_files=MediaManifest(MediaFile(**m) for m in data['media_files']),
+            resource_files=[ResourceFile(**r) for r in data['resource_files']],
+            thread_date=data['thread_date'],
+            thread_id=data['thread_id'],
+            posts_count=data['posts_count'],
+            posts=[Post(**p) for p in data['posts']]
+        )
+
+
 # Расширения для конвертации в JPG
 CONVERTIBLE_EXTENSIONS = ['.png', '.webp', '.bmp']
 
+# Видео из onclick: expand_local('16_1','https://i.arhivach.vc/storage/d/1a/filename.mp4','0','0',event)
+EXPAND_LOCAL_VIDEO_RE = re.compile(r"expand_local\([^,]+,'(https?://[^']+\.(?:mp4|webm|mov))'", re.IGNORECASE)
+EXPAND_LOCAL_URL_RE = re.compile(r"(expand_local\([^,]+,')https?://[^']+/storage/[^']+/([^']+)('[^)]*\))")
+AJAX_URL_RE = re.compile(r"var ajax_url\s*=\s*'[^']*'")
+THREAD_HREF_RE = re.compile(r'/thread/\d+')
+PAGE_OFFSET_RE = re.compile(r'/index/(\d+)/\?')
+
+# Запросы к странице тега (компилируются один раз)
+TAG_TABLE_XPATH = lxml.etree.XPath('//table[contains(concat(" ", normalize-space(@class), " "), " thread_list ")]')
+# Счётчик постов: ячейка строки с классом thread_posts_count или элемент с ним внутри ячейки
+TAG_POSTS_XPATH = lxml.etree.XPath(
+    './td[contains(concat(" ", normalize-space(@class), " "), " thread_posts_count ")]'
+    ' | ./td//*[contains(concat(" ", normalize-space(@class), " "), " thread_posts_count ")]'
+)
+# Заголовок колонки с количеством постов (если у ячеек нет класса)
+TAG_POSTS_HEADER_RE = re.compile(r'^(?:постов|посты|ответов|posts|replies)$', re.IGNORECASE)
+TAG_PAGINATION_XPATH = lxml.etree.XPath('//a[contains(@href, $tag)]')
+
+# Парсер для бэкенда lxml: Архивач отдаёт страницы в UTF-8
+LXML_HTML_PARSER = lxml.html.HTMLParser(encoding='utf-8')
+
+# Атрибуты, которые libxml2 при записи HTML экранирует как URI
+LXML_URI_ATTRS = ('href', 'src', 'action', 'name')
+
+
+def _lxml_text(element) -> str:
+    """Текст элемента без пробелов по краям фрагментов (как get_text(strip=True))"""
+    return ''.join(text.strip() for text in element.itertext())
+
+
+def _lxml_has_class(element, class_name: str) -> bool:
+    return class_name in (element.get('class') or '').split()
+
+
+def _lxml_restore_uri_attrs(html: str, elements: Iterable) -> str:
+    """
+    Вернуть не-ASCII символы в URI-атрибуты после lxml.html.tostring
+    
+    libxml2 пишет href="media/%D0%9F%D0%98%D0%9A.gif", а BeautifulSoup
+    сохраняет значение как есть: href="media/ПИК.gif".
+    
+    Args:
+        html: Результат lxml.html.tostring
+        elements: Элементы, у которых могут быть такие атрибуты
+    """
+    replacements = {}
+    for el in elements:
+        for attr in LXML_URI_ATTRS:
+            value = el.get(attr)
+            if not value or value.isascii():
+                continue
+            # Оба варианта записи атрибута получаем у самого libxml2
+            escaped = lxml.html.tostring(lxml.html.Element(el.tag, {attr: value}), encoding='unicode')
+            plain = lxml.html.tostring(lxml.html.Element(el.tag, {'title': value}), encoding='unicode')
+            escaped = escaped[escaped.index(' ') + 1:escaped.index('>')]
+            plain = attr + plain[plain.index(' ') + 6:plain.index('>')]
+            if escaped != plain:
+                replacements[escaped] = plain
+    for escaped, plain in replacements.items():
+        html = html.replace(escaped, plain)
+    return html
+
+
+def _soup_post_text(node: Tag) -> str:
+    """Текст поста: пробелы как на странице, <br> - перевод строки"""
+    parts = []
+    for item in node.descendants:
+        if isinstance(item, Tag):
+            if item.name == 'br':
+                parts.append('\n')
+        elif isinstance(item, NavigableString) and not isinstance(item, Comment):
+            parts.append(str(item))
+    return ''.join(parts).strip()
+
+
+def _lxml_post_text(element) -> str:
+    """То же, что _soup_post_text, для lxml.html"""
+    parts = []
+    
+    def walk(el):
+        if el.text:
+            parts.append(el.text)
+        for child in el:
+            if child.tag == 'br':
+                parts.append('\n')
+            elif isinstance(child.tag, str):
+                walk(child)
+            if child.tail:
+                parts.append(child.tail)
+    
+    walk(element)
+    return ''.join(parts).strip()
+
+
+# Локальные файлы в onclick: expand_local('16_1','media/filename.mp4',...)
+POST_MEDIA_RE = re.compile(r"'media/([^']+)'")
+POST_ID_RE = re.compile(r'post_(\d+)')
+POST_TIME_RE = re.compile(r'(\d{2})/(\d{2})/(\d{2})\D+(\d{2}:\d{2}(?::\d{2})?)')
+
+
+def parse_post_time(time_text: str) -> str:
+    """
+    Преобразовать время поста в сортируемый вид
+    Формат входной даты: "20/01/25 Пнд 16:33:14"
+    Формат выходной: "2025-01-20 16:33:14"
+    """
+    match = POST_TIME_RE.search(time_text)
+    if not match:
+        return ""
+    day, month, year, clock = match.groups()
+    if len(clock) == 5:
+        clock += ':00'
+    return f"20{year}-{month}-{day} {clock}"
+
+
+class _PostBuilder:
+    """Сбор полей поста при обходе его узлов (общий для обоих бэкендов)"""
+    
+    def __init__(self, number: str):
+        self.post = Post(number=number)
+        self.has_time = self.has_subject = self.has_text = False
+    
+    def add_attachment(self, value):
+        """Учесть ссылку на локальный файл (превью видео не считаются вложениями)"""
+        if isinstance(value, str) and value.startswith('media/'):
+            name = value[len('media/'):]
+            if not name.endswith('_thumb.jpg') and name not in self.post.attachments:
+                self.post.attachments.append(name)
+    
+    def add_node(self, classes, get_attr, get_text):
+        """
+        Учесть узел поста
+        
+        Args:
+            classes: CSS-классы узла
+            get_attr: Функция получения атрибута узла
+            get_text: Функция получения текста узла (True - текст поста
+                с переводами строк, False - короткое поле)
+        """
+        if not self.has_time and 'post_time' in classes:
+            self.post.time = get_text(False)
+            self.post.posted_at = parse_post_time(self.post.time)
+            self.has_time = True
+        elif not self.has_subject and 'post_subject' in classes:
+            self.post.subject = get_text(False)
+            self.has_subject = True
+        elif not self.has_text and 'post_comment_body' in classes:
+            self.post.text = get_text(True)
+            self.has_text = True
+        for attr in ('href', 'src', 'data-src'):
+            self.add_attachment(get_attr(attr))
+        onclick = get_attr('onclick')
+        if onclick:
+            for name in POST_MEDIA_RE.findall(onclick):
+                self.add_attachment('media/' + name)
+
 
 def get_html_filename(filename: str) -> str:
     """
@@ -68,26 +367,44 @@ class ArhivachParser:
         self.session.headers.update({
             'User-Agent': config.USER_AGENT
         })
+        # Общий кеш CSS/JS на весь архив
+        self.resources = ResourceCache(self.session)
+        # ETag/Last-Modified страниц для условных запросов
+        self.pages = PageCache()
+        # Результаты разбора по хешу страницы
+        self.parse_cache = ParseCache()
     
-    def _get_page(self, url: str) -> Optional[BeautifulSoup]:
-        """Получить и распарсить страницу"""
-        try:
-            response = self.session.get(url, timeout=config.REQUEST_TIMEOUT)
-            response.raise_for_status()
-            return BeautifulSoup(response.content, 'lxml')
-        except requests.RequestException as e:
-            print(f"Ошибка при загрузке страницы {url}: {e}")
-            return None
-    
-    def _get_raw_page(self, url: str) -> Optional[str]:
-        """Получить сырой HTML страницы"""
+    def _fetch_page(self, url: str, conditional: bool = False,
+                    need_body: bool = False) -> Tuple[Optional[bytes], bool]:
+        """
+        Получить сырой HTML страницы, по возможности условным запросом
+        
+        Args:
+            url: URL страницы
+            conditional: Отправить If-None-Match/If-Modified-Since
+            need_body: При 304 вернуть сохранённую копию страницы
+            
+        Returns:
+            Tuple[content, not_modified]: content = None при ошибке
+            (или при 304 без need_body)
+        """
+        headers = {}
+        if conditional and config.CONDITIONAL_REQUESTS:
+            headers = self.pages.headers(url, need_body)
         try:
-            response = self.session.get(url, timeout=config.REQUEST_TIMEOUT)
+            rate_limiter.acquire(url)
+            response = self.session.get(url, headers=headers, timeout=config.REQUEST_TIMEOUT)
+            if response.status_code == 304 and headers:
+                content = self.pages.hit(url, need_body)
+                return (content or None), True
             response.raise_for_status()
-            return response.text
         except requests.RequestException as e:
             print(f"Ошибка при загрузке страницы {url}: {e}")
-            return None
+            return None, False
+        
+        self.pages.update(url, response.headers.get('ETag'), response.headers.get('Last-Modified'),
+                          response.content, keep_body=need_body)
+        return response.content, False
     
     def _normalize_url(self, url: str) -> str:
         """Нормализовать URL"""
@@ -135,102 +452,135 @@ class ArhivachParser:
         Returns:
             Tuple[List[ThreadInfo], int]: Список тредов и общее количество страниц
         """
-        # Формируем URL с учётом offset
+        # Список тредов берётся из сохранённой копии, если страница не изменилась
+        content, _ = self._fetch_page(self._tag_page_url(tag_id, offset), conditional=True, need_body=True)
+        if not content:
+            return [], 0
+        
+        return self.parse_tag_page_html(content, tag_id)
+    
+    def _tag_page_url(self, tag_id: int, offset: int = 0) -> str:
+        """Сформировать URL страницы тега с учётом offset"""
         if offset == 0:
-            url = f"{self.domain}/?tags={tag_id}"
-        else:
-            url = f"{self.domain}/index/{offset}/?tags={tag_id}"
+            return f"{self.domain}/?tags={tag_id}"
+        return f"{self.domain}/index/{offset}/?tags={tag_id}"
+    
+    def parse_tag_page_html(self, content: bytes, tag_id: int) -> Tuple[List[ThreadInfo], int]:
+        """
+        Разбор уже загруженной страницы тега
         
-        soup = self._get_page(url)
-        if not soup:
-            return [], 0
+        Страница тега - это только таблица тредов и пагинация, поэтому
+        независимо от PARSER_BACKEND она разбирается напрямую через lxml.
         
+        Returns:
+            Tuple[List[ThreadInfo], int]: Список тредов и общее количество страниц
+        """
+        return self._parse_tag_page_lxml(lxml.html.document_fromstring(content, parser=LXML_HTML_PARSER), tag_id)
+    
+    def _parse_tag_page_lxml(self, doc, tag_id: int) -> Tuple[List[ThreadInfo], int]:
+        """Извлечь список тредов и количество страниц из дерева lxml.html страницы тега"""
         threads = []
         
         # Ищем таблицу с тредами
-        thread_table = soup.find('table', class_='thread_list') or soup.find('table')
+        tables = TAG_TABLE_XPATH(doc) or doc.xpath('//table')
         
-        if thread_table:
-            rows = thread_table.find_all('tr')
-            for row in rows:
-                # Пропускаем заголовок таблицы
-                if row.find('th'):
+        if tables:
+            posts_column = None
+            for row in tables[0].iter('tr'):
+                # Пропускаем заголовок таблицы, запомнив колонку количества постов
+                headers = row.findall('th')
+                if headers:
+                    for index, header in enumerate(headers):
+                        if TAG_POSTS_HEADER_RE.match(_lxml_text(header)):
+                            posts_column = index
                     continue
                 
-                cells = row.find_all('td')
+                cells = row.findall('.//td')
                 if len(cells) >= 2:
-                    # Ищем ссылку на тред
-                    link = row.find('a', href=re.compile(r'/thread/\d+'))
-                    if link:
+                    link = next((a for a in row.iter('a') if THREAD_HREF_RE.search(a.get('href') or '')), None)
+                    if link is not None:
                         thread_url = self._normalize_url(link.get('href', ''))
-                        thread_title = link.get_text(strip=True)[:100]
-                        thread_id = self._extract_thread_id(thread_url)
-                        
-                        # Ищем дату в последней ячейке
-                        date_cell = cells[-1]
-                        date_str = date_cell.get_text(strip=True)
-                        
+                        # Количество постов из своей колонки; 0 - неизвестно
+                        counters = TAG_POSTS_XPATH(row)
+                        if not counters and posts_column is not None and posts_column < len(cells):
+                            counters = [cells[posts_column]]
+                        posts_count = 0
+                        for counter in counters:
+                            text = _lxml_text(counter)
+                            if text.isdigit():
+                                posts_count = int(text)
+                                break
                         threads.append(ThreadInfo(
                             url=thread_url,
-                            title=thread_title,
-                            date=date_str,
-                            thread_id=thread_id
+                            title=_lxml_text(link)[:100],
+                            date=_lxml_text(cells[-1]),
+                            thread_id=self._extract_thread_id(thread_url),
+                            posts_count=posts_count
                         ))
         
-        # Определяем количество страниц из пагинации
-        # Ищем все ссылки с паттерном /index/OFFSET/?tags=
+        # Количество страниц по ссылкам пагинации /index/OFFSET/?tags=TAG_ID:
+        # страница = offset / 25 + 1, номер страницы в тексте ссылки тоже учитываем
         total_pages = 1
-        
-        # Ищем все ссылки на странице
-        all_links = soup.find_all('a', href=True)
-        for link in all_links:
-            href = link.get('href', '')
-            # Ищем паттерн /index/NUMBER/?tags=TAG_ID
-            if f'tags={tag_id}' in href:
-                # Паттерн /index/OFFSET/
-                offset_match = re.search(r'/index/(\d+)/\?', href)
-                if offset_match:
-                    page_offset = int(offset_match.group(1))
-                    # Страница = offset / 25 + 1
-                    page_num = (page_offset // 25) + 1
-                    total_pages = max(total_pages, page_num)
-                
-                # Также проверяем текст ссылки (номер страницы напрямую)
-                link_text = link.get_text(strip=True)
-                if link_text.isdigit():
-                    total_pages = max(total_pages, int(link_text))
+        for link in TAG_PAGINATION_XPATH(doc, tag=f'tags={tag_id}'):
+            offset_match = PAGE_OFFSET_RE.search(link.get('href'))
+            if offset_match:
+                total_pages = max(total_pages, int(offset_match.group(1)) // 25 + 1)
+            link_text = _lxml_text(link)
+            if link_text.isdigit():
+                total_pages = max(total_pages, int(link_text))
         
         return threads, total_pages
     
-    def get_all_threads_from_tag(self, tag_id: int, max_pages: int = None) -> List[ThreadInfo]:
+    def sync_threads_from_tag(self, tag_id: int, is_known: Callable[[ThreadInfo], bool],
+                              stop_after: int = None, max_pages: int = None) -> List[ThreadInfo]:
         """
-        Получить все треды по тегу со всех страниц
+        Получить новые и обновлённые треды тега для синхронизации архива
+        
+        Страницы тега идут от новых тредов к старым и загружаются по одной.
+        Как только подряд встречается stop_after уже загруженных тредов,
+        дальше архив считается актуальным и пагинация прекращается.
         
         Args:
             tag_id: ID тега
+            is_known: Проверка, что тред уже загружен (по ID и количеству постов)
+            stop_after: Сколько загруженных тредов подряд завершают обход
+                (None = config.SYNC_STOP_AFTER_KNOWN)
             max_pages: Максимальное количество страниц для обработки (None = все)
+            
+        Returns:
+            Треды до первой серии уже загруженных (сама серия не включается)
         """
+        stop_after = max(1, stop_after or config.SYNC_STOP_AFTER_KNOWN)
         all_threads = []
+        known_run = 0
         
-        # Получаем первую страницу (offset=0)
-        threads, total_pages = self.get_threads_from_tag_page(tag_id, offset=0)
-        all_threads.extend(threads)
-        
-        if max_pages:
-            total_pages = min(total_pages, max_pages)
-        
-        print(f"Найдено страниц: {total_pages}")
-        
-        # Получаем остальные страницы
-        # Страница 2 = offset 25, страница 3 = offset 50, и т.д.
-        for page in range(2, total_pages + 1):
-            offset = (page - 1) * 25
-            print(f"Загрузка страницы {page}/{total_pages}...")
-            time.sleep(config.PAGE_REQUEST_DELAY)
-            threads, _ = self.get_threads_from_tag_page(tag_id, offset=offset)
-            all_threads.extend(threads)
+        total_pages = None
+        page = 1
+        while total_pages is None or page <= total_pages:
+            if total_pages is not None:
+                print(f"Загрузка страницы {page}/{total_pages}...")
+            threads, pages = self.get_threads_from_tag_page(tag_id, offset=(page - 1) * 25)
+            if total_pages is None:
+                total_pages = min(pages, max_pages) if max_pages else pages
+                print(f"Найдено страниц: {total_pages}")
+            
+            for thread in threads:
+                all_threads.append(thread)
+                if not is_known(thread):
+                    known_run = 0
+                    continue
+                known_run += 1
+                if known_run >= stop_after:
+                    print(f"Архив актуален начиная со страницы {page}: "
+                          f"{stop_after} загруженных тредов подряд")
+                    return all_threads[:-known_run]
+            
+            if not threads:
+                break
+            page += 1
         
-        return all_threads
+        # Дошли до конца тега: хвост из загруженных тредов тоже не нужен
+        return all_threads[:len(all_threads) - known_run]
     
     def parse_thread(self, thread_url: str) -> Tuple[Optional[str], List[MediaFile], str, str, List[ResourceFile]]:
         """
@@ -239,22 +589,154 @@ class ArhivachParser:
         Returns:
             Tuple[html_content, media_files, thread_date, thread_id, resource_files]
         """
-        soup = self._get_page(thread_url)
-        if not soup:
-            return None, [], "", "", []
+        return self.parse_thread_page(thread_url).as_tuple()
+    
+    def parse_thread_page(self, thread_url: str, conditional: bool = False) -> ThreadPage:
+        """
+        Загрузить и распарсить тред
+        
+        Args:
+            thread_url: URL треда
+            conditional: Тред уже сохранён - отправить условный запрос
+                и не разбирать страницу, если она не изменилась
+        
+        Returns:
+            Результат парсинга (html_content = None при ошибке загрузки,
+            not_modified = True при ответе 304)
+        """
+        content, not_modified = self._fetch_page(thread_url, conditional)
+        if not_modified:
+            return ThreadPage(url=thread_url, thread_id=self._extract_thread_id(thread_url), not_modified=True)
+        if not content:
+            return ThreadPage(url=thread_url)
+        
+        return self.parse_thread_html(content, thread_url)
+    
+    def parse_thread_html(self, content: bytes, thread_url: str) -> ThreadPage:
+        """
+        Парсинг уже загруженной страницы треда
+        
+        Args:
+            content: Сырой HTML страницы
+            thread_url: URL треда (для ID треда)
+        """
+        digest = None
+        if config.PARSE_CACHE_ENABLED:
+            # Страница не изменилась - берём готовый результат вместо разбора
+            settings = {name: getattr(config, name) for name in PARSE_SETTINGS}
+            settings['domain'] = self.domain
+            digest = page_digest(content, thread_url, settings)
+            cached = self.parse_cache.get(thread_url, digest)
+            if cached is not None:
+                try:
+                    return ThreadPage.from_dict(cached)
+                except (KeyError, TypeError):
+                    pass
         
-        media_files = []
+        if config.PARSER_BACKEND == 'lxml':
+            page = self._parse_thread_lxml(content, thread_url)
+        else:
+            page = self._parse_thread_soup(BeautifulSoup(content, 'lxml'), thread_url)
+        
+        if digest is not None:
+            self.parse_cache.put(thread_url, digest, page.to_dict())
+        return page
+    
+    @staticmethod
+    def _collect_thread_nodes(soup: BeautifulSoup) -> Dict[str, List[Tag]]:
+        """
+        Разложить нужные узлы треда по группам за один обход дерева
+        
+        Группы заполняются в порядке документа, т.е. так же, как их
+        вернули бы отдельные вызовы find_all.
+        """
+        nodes = {
+            'post_time': [], 'stylesheet': [], 'script': [], 'a': [], 'img': [],
+            'video': [], 'iframe': [], 'icon': [], 'onion': [], 'canonical': [], 'post': [],
+            # (узел, имя атрибута) или (строка, None) с expand_local/ajax_url
+            'inline': []
+        }
+        inline = nodes['inline']
+        for node in soup.descendants:
+            if not isinstance(node, Tag):
+                if 'expand_local' in node or 'ajax_url' in node:
+                    inline.append((node, None))
+                continue
+            for attr, value in node.attrs.items():
+                if isinstance(value, str) and ('expand_local' in value or 'ajax_url' in value):
+                    inline.append((node, attr))
+            name = node.name
+            if name == 'a':
+                if node.has_attr('href'):
+                    nodes['a'].append(node)
+            elif name == 'img':
+                nodes['img'].append(node)
+            elif name == 'span':
+                if 'post_time' in node.get('class', ()):
+                    nodes['post_time'].append(node)
+            elif name == 'script':
+                nodes['script'].append(node)
+            elif name == 'link':
+                # rel - многозначный атрибут: сравниваем и отдельные значения, и строку целиком
+                rel = node.get('rel') or []
+                if isinstance(rel, str):
+                    rel = rel.split()
+                rel_str = ' '.join(rel)
+                if 'stylesheet' in rel:
+                    nodes['stylesheet'].append(node)
+                if rel_str == 'shortcut icon' or 'icon' in rel:
+                    nodes['icon'].append(node)
+                if 'canonical' in rel:
+                    nodes['canonical'].append(node)
+            elif name == 'video':
+                nodes['video'].append(node)
+            elif name == 'iframe':
+                nodes['iframe'].append(node)
+            elif name == 'meta':
+                if node.get('http-equiv') == 'onion-location':
+                    nodes['onion'].append(node)
+            elif name == 'div':
+                if 'post' in node.get('class', ()):
+                    nodes['post'].append(node)
+        return nodes
+    
+    @staticmethod
+    def _post_number(post_id: Optional[str], element_id: Optional[str]) -> str:
+        """Номер поста из атрибута postid или id вида post_N"""
+        if post_id:
+            return post_id
+        match = POST_ID_RE.search(element_id or '')
+        return match.group(1) if match else ""
+    
+    def _extract_posts_soup(self, post_nodes: List[Tag]) -> List[Post]:
+        """Собрать посты из div.post (ссылки уже заменены на локальные)"""
+        posts = []
+        for post in post_nodes:
+            builder = _PostBuilder(self._post_number(post.get('postid'), post.get('id')))
+            for node in post.descendants:
+                if isinstance(node, Tag):
+                    builder.add_node(node.get('class', ()), node.get,
+                                     lambda body, node=node: _soup_post_text(node) if body else node.get_text(strip=True))
+            posts.append(builder.post)
+        return posts
+    
+    def _parse_thread_soup(self, soup: BeautifulSoup, thread_url: str) -> ThreadPage:
+        """Извлечь медиа и ресурсы из дерева треда и переписать ссылки на локальные"""
+        media_files = MediaManifest()
         resource_files = []
         thread_id = self._extract_thread_id(thread_url)
         
+        # Один обход дерева вместо отдельного find_all на каждый шаг
+        nodes = self._collect_thread_nodes(soup)
+        
         # Получаем дату треда из span.post_time первого поста (ОП-поста)
         thread_date = ""
-        post_time_elem = soup.find('span', class_='post_time')
-        if post_time_elem:
-            thread_date = post_time_elem.get_text(strip=True)
+        post_times = nodes['post_time']
+        if post_times:
+            thread_date = post_times[0].get_text(strip=True)
         
         # Собираем CSS файлы
-        for link in soup.find_all('link', rel='stylesheet'):
+        for link in nodes['stylesheet']:
             href = link.get('href', '')
             if href:
                 full_url = self._normalize_url(href)
@@ -264,7 +746,7 @@ class ArhivachParser:
                 link['href'] = f"resources/{filename}"
         
         # Собираем JS файлы
-        for script in soup.find_all('script', src=True):
+        for script in nodes['script']:
             src = script.get('src', '')
             if src:
                 full_url = self._normalize_url(src)
@@ -279,7 +761,7 @@ class ArhivachParser:
         # Сначала собираем оригиналы из ссылок <a> (не превью!)
         # Оригиналы имеют путь /storage/X/XX/HASH.ext (не /storage/t/)
         # Обрабатываем ссылки на изображения и видео
-        for link in soup.find_all('a', href=True):
+        for link in nodes['a']:
             href = link.get('href', '')
             if '/storage/' in href and '/storage/t/' not in href:
                 # Нормализуем URL (может быть i.arhivach.vc для видео)
@@ -293,8 +775,7 @@ class ArhivachParser:
                 
                 if file_type:
                     # Проверяем что это не дубликат
-                    if not any(m.url == full_url for m in media_files):
-                        media_files.append(MediaFile(url=full_url, filename=filename, file_type=file_type))
+                    media_files.add(MediaFile(url=full_url, filename=filename, file_type=file_type))
                     
                     # Запоминаем имя файла оригинала
                     original_filenames.add(filename)
@@ -315,7 +796,7 @@ class ArhivachParser:
                 video_hash_to_filename[hash_name] = media.filename
         
         # Теперь обрабатываем все <img> - заменяем пути
-        for img in soup.find_all('img'):
+        for img in nodes['img']:
             src = img.get('src', '') or img.get('data-src', '')
             if src and '/storage/' in src:
                 # Пропускаем служебные изображения
@@ -334,8 +815,8 @@ class ArhivachParser:
                             # Скачиваем превью видео тоже
                             full_url = self._normalize_url(src)
                             thumb_filename = f"{hash_name}_thumb.jpg"
-                            if not any(m.filename == thumb_filename for m in media_files):
-                                media_files.append(MediaFile(url=full_url, filename=thumb_filename, file_type='image'))
+                            if not media_files.has_filename(thumb_filename):
+                                media_files.add(MediaFile(url=full_url, filename=thumb_filename, file_type='image'))
                             if img.get('src'):
                                 img['src'] = f"media/{thumb_filename}"
                             if img.get('data-src'):
@@ -354,8 +835,7 @@ class ArhivachParser:
                     # Это не превью, добавляем в список для скачивания если ещё нет
                     full_url = self._normalize_url(src)
                     file_type = self._get_file_type(filename)
-                    if file_type and not any(m.url == full_url for m in media_files):
-                        media_files.append(MediaFile(url=full_url, filename=filename, file_type=file_type))
+                    if file_type and media_files.add(MediaFile(url=full_url, filename=filename, file_type=file_type)):
                         original_filenames.add(filename)
                     
                     html_filename = get_html_filename(filename)
@@ -365,7 +845,7 @@ class ArhivachParser:
                         img['data-src'] = f"media/{html_filename}"
         
         # Находим видео из <video> тегов
-        for video in soup.find_all('video'):
+        for video in nodes['video']:
             src = video.get('src', '')
             if not src:
                 source = video.find('source')
@@ -375,8 +855,7 @@ class ArhivachParser:
                 full_url = self._normalize_url(src)
                 filename = self._extract_filename(full_url)
                 file_type = self._get_file_type(filename)
-                if file_type and not any(m.url == full_url for m in media_files):
-                    media_files.append(MediaFile(url=full_url, filename=filename, file_type=file_type))
+                if file_type and media_files.add(MediaFile(url=full_url, filename=filename, file_type=file_type)):
                     if video.get('src'):
                         video['src'] = f"media/{filename}"
                     source = video.find('source')
@@ -385,17 +864,18 @@ class ArhivachParser:
         
         # Находим видео из onclick событий (expand_local)
         # Формат: expand_local('16_1','https://i.arhivach.vc/storage/d/1a/filename.mp4','0','0',event)
-        html_str = str(soup)
-        video_urls = re.findall(r"expand_local\([^,]+,'(https?://[^']+\.(?:mp4|webm|mov))'", html_str, re.IGNORECASE)
-        for video_url in video_urls:
-            filename = video_url.split('/')[-1]
-            if not any(m.filename == filename for m in media_files):
-                media_files.append(MediaFile(url=video_url, filename=filename, file_type='video'))
+        # (ищем только в атрибутах и строках, где они встречаются, без сериализации документа)
+        for node, attr in nodes['inline']:
+            text = node[attr] if attr else node
+            for video_url in EXPAND_LOCAL_VIDEO_RE.findall(text):
+                filename = video_url.split('/')[-1]
+                if not media_files.has_filename(filename):
+                    media_files.add(MediaFile(url=video_url, filename=filename, file_type='video'))
         
         # ===== ОЧИСТКА HTML ОТ ВНЕШНИХ РЕСУРСОВ =====
         
         # Удаляем все скрипты с Google Analytics, Yandex и другой аналитикой
-        for script in soup.find_all('script'):
+        for script in nodes['script']:
             src = script.get('src', '')
             script_text = script.string or ''
             
@@ -410,19 +890,17 @@ class ArhivachParser:
                 continue
         
         # Удаляем iframe
-        for iframe in soup.find_all('iframe'):
+        for iframe in nodes['iframe']:
             iframe.decompose()
         
         # Удаляем favicon ссылку (вызывает ошибку 404)
-        for link in soup.find_all('link', rel='shortcut icon'):
-            link.decompose()
-        for link in soup.find_all('link', rel='icon'):
+        for link in nodes['icon']:
             link.decompose()
         
         # Удаляем canonical и onion-location (внешние ссылки)
-        for meta in soup.find_all('meta', {'http-equiv': 'onion-location'}):
+        for meta in nodes['onion']:
             meta.decompose()
-        for link in soup.find_all('link', rel='canonical'):
+        for link in nodes['canonical']:
             link.decompose()
         
         # Удаляем base tag
@@ -432,26 +910,248 @@ class ArhivachParser:
             if existing_base:
                 existing_base.decompose()
         
-        # Получаем HTML как строку для дополнительных замен
+        # Блокируем AJAX запросы (URL заменяется на пустой) и заменяем ссылки
+        # на i.arhivach.vc в onclick на локальные пути - прямо в узлах дерева
+        for node, attr in nodes['inline']:
+            if node.decomposed:
+                continue
+            text = node[attr] if attr else str(node)
+            new_text = AJAX_URL_RE.sub("var ajax_url = ''", text)
+            new_text = EXPAND_LOCAL_URL_RE.sub(lambda m: f"{m.group(1)}media/{m.group(2)}{m.group(3)}", new_text)
+            if new_text == text:
+                continue
+            if attr:
+                node[attr] = new_text
+            else:
+                # Сохраняем тип строки (Script, Comment и т.д.), от него зависит экранирование
+                node.replace_with(type(node)(new_text))
+        
+        # Посты - из тех же узлов, уже с локальными ссылками
+        posts = self._extract_posts_soup(nodes['post'])
+        
+        # Документ сериализуется один раз
         html_content = str(soup)
         
-        # Блокируем AJAX запросы - заменяем URL на пустой
-        html_content = re.sub(r"var ajax_url\s*=\s*'[^']*'", "var ajax_url = ''", html_content)
+        return ThreadPage(
+            url=thread_url,
+            html_content=html_content,
+            media_files=media_files,
+            resource_files=resource_files,
+            thread_date=thread_date,
+            thread_id=thread_id,
+            posts_count=len(post_times),
+            posts=posts
+        )
+    
+    def _parse_thread_lxml(self, content: bytes, thread_url: str) -> ThreadPage:
+        """
+        То же, что _parse_thread_soup, на дереве lxml.html
+        
+        Списки медиа и ресурсов совпадают с бэкендом BeautifulSoup,
+        HTML отличается только форматом сериализации (lxml пишет <br>, а не <br/>).
+        """
+        doc = lxml.html.document_fromstring(content, parser=LXML_HTML_PARSER)
+        media_files = MediaManifest()
+        resource_files = []
+        thread_id = self._extract_thread_id(thread_url)
+        
+        # Один обход дерева: раскладываем узлы по группам
+        post_times, stylesheets, scripts, anchors, imgs, videos, post_nodes = [], [], [], [], [], [], []
+        removed, inline, uri_nodes = [], [], []
+        for el in doc.iter():
+            if not isinstance(el.tag, str):
+                # Комментарии и инструкции: важен только хвостовой текст
+                if el.tail and ('expand_local' in el.tail or 'ajax_url' in el.tail):
+                    inline.append((el, 'tail'))
+                continue
+            for attr, value in el.attrib.items():
+                if 'expand_local' in value or 'ajax_url' in value:
+                    inline.append((el, attr))
+                if attr in LXML_URI_ATTRS and not value.isascii():
+                    uri_nodes.append(el)
+            for part in ('text', 'tail'):
+                text = getattr(el, part)
+                if text and ('expand_local' in text or 'ajax_url' in text):
+                    inline.append((el, part))
+            
+            tag = el.tag
+            if tag == 'a':
+                if el.get('href') is not None:
+                    anchors.append(el)
+            elif tag == 'img':
+                imgs.append(el)
+            elif tag == 'span':
+                if _lxml_has_class(el, 'post_time'):
+                    post_times.append(el)
+            elif tag == 'script':
+                scripts.append(el)
+            elif tag == 'link':
+                rel = (el.get('rel') or '').split()
+                if 'stylesheet' in rel:
+                    stylesheets.append(el)
+                if 'icon' in rel or 'canonical' in rel:
+                    removed.append(el)
+            elif tag == 'video':
+                videos.append(el)
+            elif tag == 'iframe':
+                removed.append(el)
+            elif tag == 'meta':
+                if el.get('http-equiv') == 'onion-location':
+                    removed.append(el)
+            elif tag == 'div':
+                if _lxml_has_class(el, 'post'):
+                    post_nodes.append(el)
+        
+        # Дата треда из span.post_time первого поста (ОП-поста)
+        thread_date = _lxml_text(post_times[0]) if post_times else ""
+        
+        # CSS и JS файлы
+        for link in stylesheets:
+            href = link.get('href', '')
+            if href:
+                full_url = self._normalize_url(href)
+                filename = self._extract_resource_filename(full_url, 'css')
+                resource_files.append(ResourceFile(url=full_url, filename=filename, resource_type='css'))
+                link.set('href', f"resources/{filename}")
+        for script in scripts:
+            src = script.get('src', '')
+            if src:
+                full_url = self._normalize_url(src)
+                filename = self._extract_resource_filename(full_url, 'js')
+                resource_files.append(ResourceFile(url=full_url, filename=filename, resource_type='js'))
+                script.set('src', f"resources/{filename}")
+        
+        # Оригиналы из ссылок <a> (/storage/X/XX/HASH.ext, не превью /storage/t/)
+        original_filenames = set()
+        for link in anchors:
+            href = link.get('href')
+            if '/storage/' in href and '/storage/t/' not in href:
+                full_url = href if href.startswith('http') else self._normalize_url(href)
+                filename = self._extract_filename(full_url)
+                file_type = self._get_file_type(filename)
+                if file_type:
+                    media_files.add(MediaFile(url=full_url, filename=filename, file_type=file_type))
+                    original_filenames.add(filename)
+                    html_filename = get_html_filename(filename) if file_type == 'image' else filename
+                    link.set('href', f"media/{html_filename}")
+        
+        # Хеш -> имя файла для видео (для превью)
+        video_hash_to_filename = {}
+        for media in media_files:
+            if media.file_type == 'video':
+                video_hash_to_filename[media.filename.rsplit('.', 1)[0]] = media.filename
+        
+        def set_img_src(img, value):
+            if img.get('src'):
+                img.set('src', value)
+            if img.get('data-src'):
+                img.set('data-src', value)
+        
+        for img in imgs:
+            src = img.get('src', '') or img.get('data-src', '')
+            if not src or '/storage/' not in src:
+                continue
+            if any(x in src for x in ['favicon', 'logo', 'icon', 'avatar', 'button']):
+                continue
+            
+            filename = self._extract_filename(src)
+            if '/storage/t/' in src:
+                if filename.endswith('.thumb'):
+                    hash_name = filename.replace('.thumb', '')
+                    if hash_name in video_hash_to_filename:
+                        thumb_filename = f"{hash_name}_thumb.jpg"
+                        if not media_files.has_filename(thumb_filename):
+                            media_files.add(MediaFile(url=self._normalize_url(src), filename=thumb_filename,
+                                                      file_type='image'))
+                        set_img_src(img, f"media/{thumb_filename}")
+                        continue
+                if filename in original_filenames:
+                    set_img_src(img, f"media/{get_html_filename(filename)}")
+            else:
+                full_url = self._normalize_url(src)
+                file_type = self._get_file_type(filename)
+                if file_type and media_files.add(MediaFile(url=full_url, filename=filename, file_type=file_type)):
+                    original_filenames.add(filename)
+                set_img_src(img, f"media/{get_html_filename(filename)}")
+        
+        for video in videos:
+            source = video.find('.//source')
+            src = video.get('src', '')
+            if not src and source is not None:
+                src = source.get('src', '')
+            if src and '/storage/' in src:
+                full_url = self._normalize_url(src)
+                filename = self._extract_filename(full_url)
+                file_type = self._get_file_type(filename)
+                if file_type and media_files.add(MediaFile(url=full_url, filename=filename, file_type=file_type)):
+                    if video.get('src'):
+                        video.set('src', f"media/{filename}")
+                    if source is not None and source.get('src'):
+                        source.set('src', f"media/{filename}")
+        
+        # Видео из onclick (expand_local), затем замена ссылок и ajax_url на месте.
+        # Замена делается до удаления узлов: drop_tree переносит хвостовой текст
+        for el, part in inline:
+            text = getattr(el, part) if part in ('text', 'tail') else el.get(part)
+            for video_url in EXPAND_LOCAL_VIDEO_RE.findall(text):
+                filename = video_url.split('/')[-1]
+                if not media_files.has_filename(filename):
+                    media_files.add(MediaFile(url=video_url, filename=filename, file_type='video'))
+            new_text = AJAX_URL_RE.sub("var ajax_url = ''", text)
+            new_text = EXPAND_LOCAL_URL_RE.sub(lambda m: f"{m.group(1)}media/{m.group(2)}{m.group(3)}", new_text)
+            if new_text != text:
+                if part in ('text', 'tail'):
+                    setattr(el, part, new_text)
+                else:
+                    el.set(part, new_text)
+        
+        # ===== ОЧИСТКА HTML ОТ ВНЕШНИХ РЕСУРСОВ =====
+        for script in scripts:
+            src = script.get('src', '')
+            script_text = script.text or ''
+            if src and ('google' in src or 'yandex' in src or 'counter' in src or 'analytics' in src or 'cloudflare' in src):
+                removed.append(script)
+            elif 'GoogleAnalyticsObject' in script_text or 'google-analytics' in script_text or "ga('create'" in script_text:
+                removed.append(script)
+        
+        head = doc.find('head')
+        if head is not None:
+            base = head.find('.//base')
+            if base is not None:
+                removed.append(base)
+        
+        for el in removed:
+            if el.getparent() is not None:
+                el.drop_tree()
         
-        # Заменяем ссылки на i.arhivach.vc в onclick на локальные пути
-        # expand_local('16_1','https://i.arhivach.vc/storage/...',...)
-        def replace_expand_local(match):
-            full_url = match.group(2)
-            filename = full_url.split('/')[-1]
-            return f"{match.group(1)}media/{filename}{match.group(3)}"
+        posts = []
+        for post in post_nodes:
+            builder = _PostBuilder(self._post_number(post.get('postid'), post.get('id')))
+            for el in post.iterdescendants():
+                if isinstance(el.tag, str):
+                    builder.add_node(
+                        (el.get('class') or '').split(), el.get,
+                        lambda body, el=el: _lxml_post_text(el) if body else _lxml_text(el)
+                    )
+            posts.append(builder.post)
         
-        html_content = re.sub(
-            r"(expand_local\([^,]+,')https?://[^']+/storage/[^']+/([^']+)('[^)]*\))",
-            lambda m: f"{m.group(1)}media/{m.group(2)}{m.group(3)}",
-            html_content
+        html_content = lxml.html.tostring(doc, encoding='unicode', doctype=doc.getroottree().docinfo.doctype)
+        # Переписанные ссылки на media/ и resources/ тоже могли получить не-ASCII имя
+        html_content = _lxml_restore_uri_attrs(
+            html_content,
+            itertools.chain(uri_nodes, anchors, imgs, videos, doc.iter('source'), stylesheets, scripts)
         )
         
-        return html_content, media_files, thread_date, thread_id, resource_files
+        return ThreadPage(
+            url=thread_url,
+            html_content=html_content,
+            media_files=media_files,
+            resource_files=resource_files,
+            thread_date=thread_date,
+            thread_id=thread_id,
+            posts_count=len(post_times),
+            posts=posts
+        )
     
     def get_folder_name(self, thread_date: str, thread_id: str) -> str:
         """
@@ -510,18 +1210,187 @@ class ArhivachParser:
                 return 'other'
         
         return None
+
+
+# Настройки, от которых зависит результат разбора треда (входят в ключ кеша разбора)
+PARSE_SETTINGS = ('PARSER_BACKEND', 'CONVERT_IMAGES_TO_JPG', 'MEDIA_EXTENSIONS')
+
+# Настройки, передаваемые в процесс пула: разбор и расположение кеша разбора
+WORKER_SETTINGS = PARSE_SETTINGS + ('PARSE_CACHE_ENABLED', 'PARSE_CACHE_DIR', 'OUTPUT_DIR')
+
+# Парсер процесса пула (создаётся один раз на процесс)
+_worker_parser: Optional[ArhivachParser] = None
+
+
+def parse_settings() -> Dict[str, object]:
+    """Текущие значения настроек разбора для передачи в процесс пула"""
+    return {name: getattr(config, name) for name in WORKER_SETTINGS}
+
+
+def parse_thread_html_in_worker(content: bytes, thread_url: str, domain: str,
+                                settings: Dict[str, object]) -> ThreadPage:
+    """
+    Разобрать тред в процессе пула
     
-    def download_resource(self, url: str, filepath: str) -> bool:
-        """Скачать ресурсный файл (CSS/JS)"""
-        try:
-            response = self.session.get(url, timeout=config.REQUEST_TIMEOUT)
-            response.raise_for_status()
-            
-            # Создаём директорию если нужно
-            os.makedirs(os.path.dirname(filepath), exist_ok=True)
-            
-            with open(filepath, 'wb') as f:
-                f.write(response.content)
-            return True
-        except Exception as e:
-            return False
+    Настройки передаются явно: в процессе пула config загружен заново
+    и не видит изменений, сделанных в меню.
+    """
+    global _worker_parser
+    for name, value in settings.items():
+        setattr(config, name, value)
+    if _worker_parser is None or _worker_parser.domain != domain:
+        _worker_parser = ArhivachParser(domain)
+    return _worker_parser.parse_thread_html(content, thread_url)
+
+
+class AsyncArhivachParser:
+    """
+    Асинхронный загрузчик страниц Архивача
+    
+    Загружает страницы тега и треды параллельно (не более max_concurrent
+    запросов одновременно, с учётом общего ограничителя частоты)
+    через общий пул соединений. Разбор HTML
+    выполняет обычный ArhivachParser, поэтому результат совпадает
+    с синхронной версией. При parse_workers > 0 треды разбираются
+    в пуле процессов, и разбор масштабируется по ядрам.
+    
+    Пример:
+        async with AsyncArhivachParser() as fetcher:
+            threads = await fetcher.get_all_threads_from_tag(14905)
+    """
+    
+    def __init__(self, parser: ArhivachParser = None, max_concurrent: int = None, parse_workers: int = None):
+        self.parser = parser or ArhivachParser()
+        self.domain = self.parser.domain
+        self.max_concurrent = max(1, max_concurrent or config.MAX_CONCURRENT_PAGES)
+        self.parse_workers = config.PARSE_WORKERS if parse_workers is None else parse_workers
+        self.semaphore = None
+        self.session = None
+        self.executor = None
+    
+    async def __aenter__(self):
+        self.semaphore = asyncio.Semaphore(self.max_concurrent)
+        timeout = aiohttp.ClientTimeout(total=config.REQUEST_TIMEOUT)
+        connector = aiohttp.TCPConnector(
+            limit=self.max_concurrent,
+            ttl_dns_cache=config.DNS_CACHE_TTL,
+            keepalive_timeout=config.KEEPALIVE_TIMEOUT
+        )
+        self.session = aiohttp.ClientSession(
+            timeout=timeout,
+            connector=connector,
+            headers={'User-Agent': config.USER_AGENT}
+        )
+        if self.parse_workers > 0:
+            # spawn: пул создаётся из рабочего потока конвейера, fork там небезопасен
+            self.executor = ProcessPoolExecutor(self.parse_workers,
+                                                mp_context=multiprocessing.get_context('spawn'))
+        return self
+    
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        if self.session:
+            await self.session.close()
+            self.session = None
+        if self.executor:
+            self.executor.shutdown(wait=True, cancel_futures=True)
+            self.executor = None
+    
+    async def _fetch_page(self, url: str, conditional: bool = False,
+                          need_body: bool = False) -> Tuple[Optional[bytes], bool]:
+        """Получить сырой HTML страницы (см. ArhivachParser._fetch_page)"""
+        # Файлы валидаторов читаются и пишутся в пуле потоков, чтобы
+        # не останавливать остальные запросы event loop
+        pages = self.parser.pages
+        headers = {}
+        if conditional and config.CONDITIONAL_REQUESTS:
+            headers = await self._run_in_executor(pages.headers, url, need_body)
+        async with self.semaphore:
+            await rate_limiter.acquire_async(url)
+            try:
+                async with self.session.get(url, headers=headers) as response:
+                    if response.status == 304 and headers:
+                        content = await self._run_in_executor(pages.hit, url, need_body)
+                        return (content or None), True
+                    response.raise_for_status()
+                    content = await response.read()
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                print(f"Ошибка при загрузке страницы {url}: {e}")
+                return None, False
+        
+        await self._run_in_executor(pages.update, url, response.headers.get('ETag'),
+                                    response.headers.get('Last-Modified'), content, need_body)
+        return content, False
+    
+    async def _run_in_executor(self, func, *args):
+        """
+        Выполнить блокирующую работу (разбор HTML, файлы PageCache) в пуле
+        потоков, не останавливая загрузку остальных страниц
+        """
+        return await asyncio.get_running_loop().run_in_executor(None, func, *args)
+    
+    async def get_threads_from_tag_page(self, tag_id: int, offset: int = 0) -> Tuple[List[ThreadInfo], int]:
+        """Получить список тредов со страницы тега (см. ArhivachParser.get_threads_from_tag_page)"""
+        content, _ = await self._fetch_page(self.parser._tag_page_url(tag_id, offset),
+                                            conditional=True, need_body=True)
+        if not content:
+            return [], 0
+        return await self._run_in_executor(self.parser.parse_tag_page_html, content, tag_id)
+    
+    async def get_all_threads_from_tag(self, tag_id: int, max_pages: int = None) -> List[ThreadInfo]:
+        """
+        Получить все треды по тегу со всех страниц
+        
+        Первая страница нужна для определения количества страниц,
+        остальные загружаются параллельно. Треды идут в порядке страниц.
+        
+        Args:
+            tag_id: ID тега
+            max_pages: Максимальное количество страниц для обработки (None = все)
+        """
+        all_threads, total_pages = await self.get_threads_from_tag_page(tag_id, offset=0)
+        
+        if max_pages:
+            total_pages = min(total_pages, max_pages)
+        
+        print(f"Найдено страниц: {total_pages}")
+        
+        if total_pages > 1:
+            print(f"Загрузка страниц 2-{total_pages} (до {self.max_concurrent} одновременно)...")
+            pages = await asyncio.gather(*[
+                self.get_threads_from_tag_page(tag_id, offset=(page - 1) * 25)
+                for page in range(2, total_pages + 1)
+            ])
+            for threads, _ in pages:
+                all_threads.extend(threads)
+        
+        return all_threads
+    
+    async def parse_thread_page(self, thread_url: str, conditional: bool = False) -> ThreadPage:
+        """Загрузить и распарсить тред (см. ArhivachParser.parse_thread_page)"""
+        content, not_modified = await self._fetch_page(thread_url, conditional)
+        if not_modified:
+            return ThreadPage(url=thread_url, thread_id=self.parser._extract_thread_id(thread_url),
+                              not_modified=True)
+        if not content:
+            return ThreadPage(url=thread_url)
+        if self.executor:
+            return await asyncio.get_running_loop().run_in_executor(
+                self.executor, parse_thread_html_in_worker, content, thread_url, self.domain, parse_settings()
+            )
+        return await self._run_in_executor(self.parser.parse_thread_html, content, thread_url)
+
+
+def get_all_threads_from_tag_concurrent(tag_id: int, max_pages: int = None, domain: str = None) -> List[ThreadInfo]:
+    """
+    Синхронная обёртка для параллельного получения тредов по тегу
+    
+    Args:
+        tag_id: ID тега
+        max_pages: Максимальное количество страниц для обработки (None = все)
+        domain: Домен Архивача
+    """
+    async def run():
+        async with AsyncArhivachParser(ArhivachParser(domain)) as fetcher:
+            return await fetcher.get_all_threads_from_tag(tag_id, max_pages)
+    
+    return asyncio.run(run())
@@ -0,0 +1,624 @@
+"""
+Модуль конвейерной обработки тредов
+
+Парсинг следующего треда выполняется параллельно с загрузкой медиа
+текущего треда. Между стадиями стоит ограниченная очередь, поэтому
+в памяти одновременно находится лишь несколько подготовленных тредов.
+"""
+
+import os
+import re
+import json
+import queue
+import collections
+import asyncio
+import threading
+from contextlib import ExitStack
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+from dataclasses import asdict, dataclass, field
+
+import config
+from parser import ArhivachParser, AsyncArhivachParser, MediaFile, MediaManifest, Post, ThreadInfo, ThreadPage
+from downloader import DownloadStats, MediaDownloadSession, download_media_sync, find_existing, scan_media_dir
+from crawlstate import CrawlState, MEDIA_DONE, MEDIA_FAILED, THREAD_COMPLETE
+
+
+# Маркер окончания очереди
+_DONE = object()
+
+# Файл со списком медиа треда (рядом с thread.html)
+MEDIA_MANIFEST_NAME = 'media.json'
+
+# Посты треда, по одному JSON-объекту на строку
+POSTS_FILE_NAME = 'posts.jsonl'
+
+
+@dataclass
+class PreparedThread:
+    """Тред, у которого сохранены HTML и ресурсы, а медиа ещё не загружены"""
+    url: str
+    thread_id: str
+    thread_dir: str
+    media_dir: str
+    media_files: List[MediaFile] = field(default_factory=list)
+    is_new: bool = True
+    # Медиа-файлы, уже загруженные по данным базы состояния
+    media_done: int = 0
+    posts_count: int = 0
+    last_post_number: str = ""
+    # Постов после последнего известного (при инкрементальном обновлении)
+    new_posts: int = 0
+    # Загружены или выбраны для загрузки все медиа треда, а не только часть
+    all_media: bool = True
+
+
+@dataclass
+class CrawlStats:
+    """Статистика обработки списка тредов"""
+    total: int = 0
+    successful: int = 0
+    failed: int = 0
+    new_threads: int = 0
+    skipped: int = 0
+    total_media: int = 0
+    total_bytes: int = 0
+
+
+def sanitize_folder_name(name: str) -> str:
+    """Очистить имя папки от недопустимых символов"""
+    name = re.sub(r'[<>:"/\\|?*]', '_', name)
+    name = name.strip(' .')
+    return name[:200] if name else 'thread'
+
+
+def saved_thread_dir(state: Optional[CrawlState], thread_id: str, base_dir: str) -> Optional[str]:
+    """
+    Папка полностью загруженного треда, если он уже сохранён в base_dir
+
+    Для таких тредов страница запрашивается условным запросом.
+    """
+    if state is None or not thread_id:
+        return None
+    row = state.get_thread(thread_id)
+    if row is None or row['status'] != THREAD_COMPLETE or not row['folder']:
+        return None
+    thread_dir = os.path.join(base_dir, row['folder'])
+    if not os.path.isfile(os.path.join(thread_dir, 'thread.html')):
+        return None
+    return thread_dir
+
+
+def is_thread_archived(state: Optional[CrawlState], thread: ThreadInfo, base_dir: str) -> bool:
+    """Тред из списка тега полностью загружен в base_dir и с тех пор не получал новых постов"""
+    return (state is not None
+            and state.is_thread_complete(thread.thread_id, thread.posts_count)
+            and saved_thread_dir(state, thread.thread_id, base_dir) is not None)
+
+
+def prepare_thread(parser: ArhivachParser, thread_url: str, base_dir: str,
+                   only_new: bool = False, state: CrawlState = None,
+                   after_post: str = None) -> Optional[PreparedThread]:
+    """
+    Загрузить и распарсить тред, сохранить HTML и ресурсы
+
+    Args:
+        parser: Парсер Архивача
+        thread_url: URL треда
+        base_dir: Папка, в которой создаётся папка треда
+        only_new: Не перезаписывать тред, если его папка уже существует
+        state: База состояния загрузки
+        after_post: Номер последнего уже обработанного поста (см. select_new_media)
+
+    Returns:
+        Подготовленный тред или None при ошибке загрузки
+    """
+    saved_dir = saved_thread_dir(state, parser._extract_thread_id(thread_url), base_dir)
+    page = parser.parse_thread_page(thread_url, conditional=saved_dir is not None)
+    return save_thread_page(parser, page, base_dir, only_new, state, after_post=after_post)
+
+
+def select_new_media(page: ThreadPage, after_post: str,
+                     done_urls: Set[str] = None) -> Tuple[List[Post], List[MediaFile]]:
+    """
+    Посты после after_post и медиа-файлы из них
+
+    Если after_post пуст или не найден в треде, новыми считаются все посты.
+
+    Args:
+        done_urls: URL уже загруженных медиа треда (из базы состояния).
+            Остальные медиа более ранних постов тоже выбираются, чтобы файл,
+            не загрузившийся в прошлый раз, докачался при следующей проверке
+
+    Returns:
+        Tuple[new_posts, media_files]
+    """
+    numbers = [post.number for post in page.posts]
+    if not after_post or after_post not in numbers:
+        return page.posts, list(page.media_files)
+
+    new_posts = page.posts[numbers.index(after_post) + 1:]
+    names = set()
+    for post in new_posts:
+        for name in post.attachments:
+            # Вложение может называться уже после конвертации в JPG - ищем
+            # по хешу; превью видео в список вложений не входит
+            file_hash = MediaManifest.file_hash(name)
+            for media in (page.media_files.get_by_hash(file_hash),
+                          page.media_files.get_by_hash(file_hash + '_thumb')):
+                if media is not None:
+                    names.add(media.filename)
+    media_files = [m for m in page.media_files
+                   if m.filename in names or (done_urls is not None and m.url not in done_urls)]
+    return new_posts, media_files
+
+
+def pending_media(state: CrawlState, thread_id: str, media_dir: str,
+                  media_files: Iterable[MediaFile], done_urls: Set[str],
+                  index: Dict[str, int] = None) -> List[MediaFile]:
+    """
+    Медиа-файлы, которые ещё нужно загрузить
+
+    Загруженное в прошлый раз не трогаем, если файл на месте и его размер
+    совпадает с записанным в базе состояния.
+
+    Args:
+        index: Содержимое папки медиа (None = прочитать папку)
+    """
+    done_sizes = state.media_sizes(thread_id)
+    if index is None:
+        index = scan_media_dir(media_dir)
+
+    def is_done(media: MediaFile) -> bool:
+        if media.url not in done_urls:
+            return False
+        existing = find_existing(index, media.filename)
+        if existing is None:
+            return False
+        expected = done_sizes.get(media.url)
+        return not expected or index[existing] == expected
+
+    return [m for m in media_files if not is_done(m)]
+
+
+def converted_media(media_files: Iterable[MediaFile], index: Dict[str, int]) -> Dict[str, str]:
+    """
+    Файлы, которые в папке медиа лежат уже сконвертированными в JPG
+
+    Returns:
+        Имя в ссылках страницы -> имя на диске
+    """
+    renames = {}
+    for media in media_files:
+        existing = find_existing(index, media.filename)
+        if existing is not None and existing != media.filename:
+            renames[media.filename] = existing
+    return renames
+
+
+def rewrite_media_links(text: str, renames: Dict[str, str]) -> str:
+    """Заменить ссылки media/ORIGINAL на media/NEW по словарю renames"""
+    if not renames:
+        return text
+    pattern = re.compile(
+        r'media/(' + '|'.join(re.escape(name) for name in sorted(renames, key=len, reverse=True)) + r')(?![\w.-])'
+    )
+    return pattern.sub(lambda m: 'media/' + renames[m.group(1)], text)
+
+
+def save_posts_jsonl(path: str, posts: Iterable[Post]):
+    """Сохранить посты треда в JSONL"""
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        for post in posts:
+            f.write(json.dumps(asdict(post), ensure_ascii=False) + '\n')
+    os.replace(tmp_path, path)
+
+
+def last_saved_post(path: str) -> Optional[str]:
+    """Номер последнего поста в сохранённом posts.jsonl (None, если файла нет или он повреждён)"""
+    last_line = None
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    last_line = line
+        return json.loads(last_line)['number'] if last_line else None
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+
+def append_posts_jsonl(path: str, posts: Iterable[Post]):
+    """Дописать посты в конец posts.jsonl"""
+    with open(path, 'a', encoding='utf-8') as f:
+        for post in posts:
+            f.write(json.dumps(asdict(post), ensure_ascii=False) + '\n')
+
+
+def save_thread_page(parser: ArhivachParser, page: ThreadPage, base_dir: str,
+                     only_new: bool = False, state: CrawlState = None,
+                     tag_id: str = '', after_post: str = None) -> Optional[PreparedThread]:
+    """
+    Сохранить HTML и ресурсы уже распарсенного треда
+
+    Если передана база состояния, тред отмечается как начатый, его посты
+    сохраняются в базу, а медиа, загруженные в прошлых запусках,
+    исключаются из списка загрузки.
+
+    Args:
+        parser: Парсер Архивача (для имени папки и ресурсов)
+        page: Результат парсинга треда
+        base_dir: Папка, в которой создаётся папка треда
+        only_new: Не перезаписывать тред, если его папка уже существует
+        state: База состояния загрузки
+        tag_id: Тег, по которому загружается тред
+        after_post: Загружать медиа только из постов после этого номера.
+            Посты после него дописываются в posts.jsonl и базу состояния,
+            если сохранённый список кончается на after_post (иначе
+            сохраняется целиком). thread.html и media.json перезаписываются
+            полностью: Архивач отдаёт тред одной страницей, которую всё
+            равно нужно загрузить и разобрать целиком, а сохранённая копия
+            должна совпадать с ней (шапка, счётчики, ссылки)
+
+    Returns:
+        Подготовленный тред или None при ошибке загрузки
+    """
+    if page.not_modified:
+        # Страница не изменилась: сохранённый тред актуален, но файлы могли
+        # пропасть с диска - сверяем их со списком media.json без разбора страницы
+        thread_dir = saved_thread_dir(state, page.thread_id, base_dir)
+        if thread_dir is None:
+            return None
+        media_dir = os.path.join(thread_dir, 'media')
+        manifest = MediaManifest.load(os.path.join(thread_dir, MEDIA_MANIFEST_NAME))
+        missing = pending_media(state, page.thread_id, media_dir, manifest,
+                                state.done_media_urls(page.thread_id))
+        return PreparedThread(
+            url=page.url,
+            thread_id=page.thread_id,
+            thread_dir=thread_dir,
+            media_dir=media_dir,
+            media_files=missing,
+            is_new=bool(missing),
+            media_done=len(manifest) - len(missing),
+            posts_count=state.get_thread(page.thread_id)['posts_count']
+        )
+
+    if not page.html_content:
+        return None
+
+    # Формируем имя папки: ДД.ММ.ГГ_ID
+    folder_name = parser.get_folder_name(page.thread_date, page.thread_id)
+    folder_name = sanitize_folder_name(folder_name)
+    thread_dir = os.path.join(base_dir, folder_name)
+    media_dir = os.path.join(thread_dir, 'media')
+    resources_dir = os.path.join(thread_dir, 'resources')
+
+    if only_new and os.path.exists(thread_dir):
+        return PreparedThread(
+            url=page.url,
+            thread_id=page.thread_id,
+            thread_dir=thread_dir,
+            media_dir=media_dir,
+            is_new=False
+        )
+
+    os.makedirs(thread_dir, exist_ok=True)
+    os.makedirs(media_dir, exist_ok=True)
+    os.makedirs(resources_dir, exist_ok=True)
+
+    # Подключаем ресурсы (CSS/JS) из общего кеша
+    for res in page.resource_files:
+        res_path = os.path.join(resources_dir, res.filename)
+        parser.resources.materialize(res.url, res.filename, res_path)
+
+    # Файлы, сконвертированные в JPG раньше (--convert), при выключенной
+    # конвертации страница называет по-старому: ссылки ведём на JPG на диске
+    index = scan_media_dir(media_dir)
+    renames = converted_media(page.media_files, index)
+    for post in page.posts:
+        post.attachments = [rewrite_media_links(name, renames) for name in post.attachments]
+
+    # Сохраняем HTML
+    html_path = os.path.join(thread_dir, 'thread.html')
+    with open(html_path, 'w', encoding='utf-8') as f:
+        f.write(rewrite_media_links(page.html_content, renames))
+
+    # Список медиа треда (для проверки и докачки без повторного парсинга)
+    page.media_files.save(os.path.join(thread_dir, MEDIA_MANIFEST_NAME))
+
+    done_urls = None
+    if state is not None and page.thread_id:
+        done_urls = state.done_media_urls(page.thread_id)
+    new_posts, media_files = select_new_media(page, after_post, done_urls)
+
+    # Выросший тред: дописываем только новые посты
+    posts_path = os.path.join(thread_dir, POSTS_FILE_NAME)
+    start = len(page.posts) - len(new_posts)
+    append = start > 0 and last_saved_post(posts_path) == page.posts[start - 1].number
+    if append:
+        append_posts_jsonl(posts_path, new_posts)
+    else:
+        save_posts_jsonl(posts_path, page.posts)
+    selected_urls = {m.url for m in media_files}
+    all_media = all(m.url in selected_urls or (done_urls is not None and m.url in done_urls)
+                    for m in page.media_files)
+
+    media_done = 0
+    if state is not None and page.thread_id:
+        # Продолжаем с места остановки
+        candidates = len(media_files)
+        media_files = pending_media(state, page.thread_id, media_dir, media_files, done_urls, index)
+        media_done = candidates - len(media_files)
+        state.start_thread(page.thread_id, page.url, folder_name, page.posts_count,
+                           len(page.media_files), tag_id)
+        if not (append and state.append_posts(page.thread_id, new_posts, start)):
+            state.save_posts(page.thread_id, page.posts)
+
+    return PreparedThread(
+        url=page.url,
+        thread_id=page.thread_id,
+        thread_dir=thread_dir,
+        media_dir=media_dir,
+        media_files=media_files,
+        media_done=media_done,
+        posts_count=page.posts_count,
+        last_post_number=page.posts[-1].number if page.posts else "",
+        new_posts=len(new_posts),
+        all_media=all_media
+    )
+
+
+def download_thread_media(prepared: PreparedThread, downloader: MediaDownloadSession = None,
+                          state: CrawlState = None) -> DownloadStats:
+    """
+    Загрузить медиа-файлы подготовленного треда
+
+    Args:
+        prepared: Подготовленный тред
+        downloader: Общая сессия загрузки (None = отдельная сессия на тред)
+        state: База состояния загрузки (результат пишется по каждому файлу)
+    """
+    on_file_done = None
+    if state is not None and prepared.thread_id:
+        def on_file_done(media: MediaFile, ok: bool, size: int):
+            state.record_media(media.url, prepared.thread_id, media.filename, size,
+                               MEDIA_DONE if ok else MEDIA_FAILED)
+
+    expected_sizes = None
+    if state is not None and prepared.thread_id:
+        expected_sizes = state.media_sizes(prepared.thread_id)
+
+    stats = DownloadStats()
+    if prepared.media_files:
+        if downloader is not None:
+            stats = downloader.download(prepared.media_files, prepared.media_dir, on_file_done, expected_sizes)
+        else:
+            stats = download_media_sync(prepared.media_files, prepared.media_dir,
+                                        on_file_done=on_file_done, expected_sizes=expected_sizes)
+
+    if state is not None and prepared.thread_id:
+        # Загрузка только части медиа не делает тред загруженным полностью
+        state.finish_thread(prepared.thread_id, complete=stats.failed == 0 and prepared.all_media)
+    return stats
+
+
+def process_thread(parser: ArhivachParser, thread_url: str, base_dir: str,
+                   downloader: MediaDownloadSession = None, state: CrawlState = None,
+                   after_post: str = None) -> Tuple[Optional[PreparedThread], Optional[DownloadStats]]:
+    """
+    Полностью обработать один тред: HTML, ресурсы и медиа
+
+    Args:
+        after_post: Инкрементальное обновление - медиа только из постов
+            после этого номера (None = все медиа треда)
+
+    Returns:
+        Tuple[prepared, stats]: (None, None) если тред не удалось загрузить
+    """
+    prepared = prepare_thread(parser, thread_url, base_dir, state=state, after_post=after_post)
+    if prepared is None:
+        return None, None
+    if not prepared.is_new:
+        return prepared, DownloadStats()
+    return prepared, download_thread_media(prepared, downloader, state)
+
+
+class ThreadPipeline:
+    """
+    Конвейер загрузки тредов
+
+    Стадия парсинга работает в отдельном потоке и складывает подготовленные
+    треды в ограниченную очередь, а стадия загрузки медиа забирает их оттуда.
+    Пока качаются медиа треда N, уже загружается и парсится тред N+1.
+
+    Треды, полностью загруженные в прошлых запусках (по базе состояния),
+    пропускаются без запросов к сайту.
+    """
+
+    def __init__(self, parser: ArhivachParser, base_dir: str, queue_size: int = None,
+                 only_new: bool = False, verbose: bool = True,
+                 downloader: MediaDownloadSession = None, state: CrawlState = None,
+                 tag_id: str = ''):
+        self.parser = parser
+        self.base_dir = base_dir
+        self.tag_id = str(tag_id or '')
+        self.downloader = downloader
+        self.state = state
+        self.queue_size = max(1, queue_size or config.PIPELINE_QUEUE_SIZE)
+        self.only_new = only_new
+        self.verbose = verbose
+        self.stats = CrawlStats()
+
+    def _put(self, q: queue.Queue, item, stop: threading.Event) -> bool:
+        """Положить элемент в очередь, пока конвейер не остановлен"""
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _produce(self, threads: List[ThreadInfo], q: queue.Queue, stop: threading.Event):
+        """Стадия парсинга: загружает треды и сохраняет HTML"""
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(self._produce_async(threads, q, stop))
+        except Exception as e:
+            if self.verbose:
+                print(f"  [X] Ошибка парсинга: {e}")
+        finally:
+            loop.close()
+            # Стадия загрузки всегда должна получить маркер окончания
+            self._put(q, _DONE, stop)
+
+    async def _put_async(self, q: queue.Queue, item, stop: threading.Event) -> bool:
+        """То же, что _put, не останавливая event loop на полной очереди"""
+        return await asyncio.get_running_loop().run_in_executor(None, self._put, q, item, stop)
+
+    async def _produce_async(self, threads: List[ThreadInfo], q: queue.Queue, stop: threading.Event):
+        """
+        Загрузить треды, держа в работе до MAX_CONCURRENT_PAGES запросов
+
+        Страницы запрашиваются скользящим окном: как только одна загрузка
+        заканчивается, семафор загрузчика пускает следующую, не дожидаясь
+        самой медленной страницы. Стадии загрузки треды передаются в
+        исходном порядке.
+        """
+        async with AsyncArhivachParser(self.parser) as fetcher:
+            # Сколько тредов начато наперёд, пока ждём самый ранний из них
+            window = fetcher.max_concurrent * 2
+            pending = collections.deque()
+            numbered = iter(enumerate(threads, 1))
+
+            def fill():
+                while len(pending) < window:
+                    item = next(numbered, None)
+                    if item is None:
+                        return
+                    i, thread = item
+                    if is_thread_archived(self.state, thread, self.base_dir):
+                        # Полностью загруженные треды пропускаем без запросов
+                        pending.append((i, thread, None))
+                        continue
+                    task = asyncio.create_task(fetcher.parse_thread_page(
+                        thread.url,
+                        conditional=saved_thread_dir(self.state, thread.thread_id, self.base_dir) is not None
+                    ))
+                    pending.append((i, thread, task))
+
+            try:
+                fill()
+                while pending:
+                    if stop.is_set():
+                        return
+                    i, thread, task = pending.popleft()
+                    fill()
+
+                    prepared, error = None, ""
+                    if task is None:
+                        prepared = PreparedThread(url=thread.url, thread_id=thread.thread_id,
+                                                  thread_dir='', media_dir='', is_new=False)
+                    else:
+                        try:
+                            page = await task
+                            prepared = save_thread_page(self.parser, page, self.base_dir,
+                                                        self.only_new, self.state, self.tag_id)
+                            if prepared is None:
+                                error = "Ошибка загрузки"
+                        except Exception as e:
+                            error = str(e)
+
+                    if not await self._put_async(q, (i, thread, prepared, error), stop):
+                        return
+            finally:
+                for _, _, task in pending:
+                    if task is not None:
+                        task.cancel()
+                await asyncio.gather(*[task for _, _, task in pending if task is not None],
+                                     return_exceptions=True)
+
+    def _consume(self, index: int, total: int, thread: ThreadInfo,
+                 prepared: Optional[PreparedThread], error: str):
+        """Стадия загрузки: качает медиа подготовленного треда"""
+        if self.verbose:
+            print(f"\n[{index}/{total}] {thread.title[:50]}...")
+
+        if prepared is None:
+            if self.verbose:
+                print(f"  [X] {error}")
+            self.stats.failed += 1
+            return
+
+        if not prepared.is_new:
+            self.stats.successful += 1
+            self.stats.skipped += 1
+            if self.verbose:
+                print("  [=] Тред уже загружен")
+            return
+
+        self.stats.new_threads += 1
+        try:
+            stats = download_thread_media(prepared, self.downloader, self.state)
+        except Exception as e:
+            if self.verbose:
+                print(f"  [X] Ошибка: {e}")
+            self.stats.failed += 1
+            return
+
+        self.stats.successful += 1
+        self.stats.total_media += stats.completed
+        self.stats.total_bytes += stats.total_bytes
+        if self.verbose:
+            if prepared.media_done:
+                print(f"  [OK] HTML + {stats.completed} медиа-файлов "
+                      f"(ранее загружено: {prepared.media_done})")
+            elif prepared.media_files:
+                print(f"  [OK] HTML + {stats.completed} медиа-файлов")
+            else:
+                print("  [OK] HTML сохранён (медиа нет)")
+
+    def run(self, threads: List[ThreadInfo]) -> CrawlStats:
+        """
+        Обработать список тредов
+
+        Если общая сессия загрузки или база состояния не переданы,
+        конвейер открывает их сам на время обработки списка.
+
+        Returns:
+            Статистика обработки
+        """
+        self.stats = CrawlStats(total=len(threads))
+        if not threads:
+            return self.stats
+
+        downloader, state = self.downloader, self.state
+        try:
+            with ExitStack() as stack:
+                if self.downloader is None:
+                    self.downloader = stack.enter_context(MediaDownloadSession())
+                if self.state is None and config.CRAWL_STATE_ENABLED:
+                    self.state = stack.enter_context(CrawlState())
+                return self._run(threads)
+        finally:
+            self.downloader, self.state = downloader, state
+
+    def _run(self, threads: List[ThreadInfo]) -> CrawlStats:
+        """Запустить стадии конвейера"""
+        q = queue.Queue(maxsize=self.queue_size)
+        stop = threading.Event()
+        producer = threading.Thread(target=self._produce, args=(threads, q, stop), daemon=True)
+        producer.start()
+
+        try:
+            while True:
+                item = q.get()
+                if item is _DONE:
+                    break
+                index, thread, prepared, error = item
+                self._consume(index, len(threads), thread, prepared, error)
+        finally:
+            stop.set()
+            producer.join(timeout=1)
+
+        return self.stats
@@ -0,0 +1,112 @@
+"""
+Модуль ограничения частоты запросов
+
+Каждый хост получает свой «бак с токенами»: запросы расходуют токены,
+а бак пополняется с заданной скоростью до размера burst. Поэтому запрос,
+который сам шёл несколько секунд, не ждёт лишнюю фиксированную паузу.
+"""
+
+import time
+import asyncio
+import threading
+from typing import Dict, Tuple
+from urllib.parse import urlparse
+
+import config
+
+
+class TokenBucket:
+    """Потокобезопасный бак с токенами"""
+
+    def __init__(self, rate: float, burst: int = 1):
+        """
+        Args:
+            rate: Запросов в секунду (0 или меньше = без ограничения)
+            burst: Сколько запросов можно сделать подряд без ожидания
+        """
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self) -> float:
+        """
+        Забронировать токен
+
+        Returns:
+            Сколько секунд нужно подождать перед запросом
+        """
+        if self.rate <= 0:
+            return 0.0
+
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            # Токен забираем сразу, даже если бак пуст: долг определяет ожидание
+            self.tokens -= 1
+            if self.tokens >= 0:
+                return 0.0
+            return -self.tokens / self.rate
+
+    def acquire(self):
+        """Дождаться разрешения на запрос (синхронно)"""
+        delay = self.reserve()
+        if delay > 0:
+            time.sleep(delay)
+
+    async def acquire_async(self):
+        """Дождаться разрешения на запрос (асинхронно)"""
+        delay = self.reserve()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+class RateLimiter:
+    """
+    Ограничитель запросов по хостам
+
+    HTML-страницы и медиа-файлы имеют раздельные бюджеты. Медиа - это
+    запросы к хостам из config.MEDIA_HOSTS и к путям /storage/, они
+    ограничиваются MEDIA_REQUESTS_PER_SECOND. Остальные запросы
+    ограничиваются частотой, заданной PAGE_REQUEST_DELAY.
+    """
+
+    def __init__(self):
+        self.buckets: Dict[Tuple[str, str], TokenBucket] = {}
+        self.lock = threading.Lock()
+
+    def _budget(self, kind: str) -> Tuple[float, int]:
+        """Получить (запросов в секунду, burst) для вида запросов"""
+        if kind == 'media':
+            return config.MEDIA_REQUESTS_PER_SECOND, config.MEDIA_REQUEST_BURST
+        if config.PAGE_REQUEST_DELAY <= 0:
+            return 0.0, config.PAGE_REQUEST_BURST
+        return 1.0 / config.PAGE_REQUEST_DELAY, config.PAGE_REQUEST_BURST
+
+    def bucket(self, url: str) -> TokenBucket:
+        """Получить бак для хоста и вида запроса из URL"""
+        parsed = urlparse(url)
+        host = parsed.hostname or ''
+        kind = 'media' if host in config.MEDIA_HOSTS or '/storage/' in parsed.path else 'html'
+        rate, burst = self._budget(kind)
+        with self.lock:
+            bucket = self.buckets.get((host, kind))
+            # Настройки могли измениться в меню - пересоздаём бак
+            if bucket is None or bucket.rate != rate or bucket.burst != max(1, burst):
+                bucket = TokenBucket(rate, burst)
+                self.buckets[(host, kind)] = bucket
+            return bucket
+
+    def acquire(self, url: str):
+        """Дождаться разрешения на запрос к url (синхронно)"""
+        self.bucket(url).acquire()
+
+    async def acquire_async(self, url: str):
+        """Дождаться разрешения на запрос к url (асинхронно)"""
+        await self.bucket(url).acquire_async()
+
+
+# Общий ограничитель для всех запросов программы
+rate_limiter = RateLimiter()
@@ -0,0 +1,131 @@
+"""
+Модуль общего кеша ресурсов (CSS, JS)
+
+Все треды ссылаются на одни и те же файлы стилей и скриптов сайта.
+Кеш хранит их один раз на весь архив, проверяет актуальность по
+ETag/Last-Modified не чаще одного раза за запуск и подключает
+в папки тредов жёсткими ссылками.
+"""
+
+import os
+import json
+import hashlib
+import threading
+from typing import Dict, Optional
+
+import requests
+
+import config
+from ratelimit import rate_limiter
+from mediastore import link_file
+
+
+class ResourceCache:
+    """Кеш ресурсов с ключом по URL"""
+
+    def __init__(self, session: requests.Session = None, root: str = None):
+        self.session = session or requests.Session()
+        self.root = root or config.RESOURCE_CACHE_DIR or os.path.join(config.OUTPUT_DIR, '.resources')
+        self.index_path = os.path.join(self.root, 'index.json')
+        self.index: Optional[Dict[str, dict]] = None
+        # URL, уже проверенные в этом запуске
+        self.validated = set()
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.not_modified = 0
+
+    def _load_index(self):
+        """Загрузить индекс кеша"""
+        if self.index is not None:
+            return
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                self.index = json.load(f)
+        except (OSError, ValueError):
+            self.index = {}
+
+    def _save_index(self):
+        """Сохранить индекс кеша"""
+        os.makedirs(self.root, exist_ok=True)
+        tmp_path = self.index_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.index, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.index_path)
+
+    def _cache_path(self, url: str, filename: str) -> str:
+        """Путь к файлу в кеше (разные URL с одинаковым именем не пересекаются)"""
+        url_hash = hashlib.md5(url.encode()).hexdigest()[:12]
+        return os.path.join(self.root, f"{url_hash}_{filename}")
+
+    def get(self, url: str, filename: str) -> Optional[str]:
+        """
+        Получить актуальную копию ресурса
+
+        При первом обращении за запуск отправляется условный запрос
+        (If-None-Match/If-Modified-Since), дальше файл берётся из кеша
+        без запросов.
+
+        Returns:
+            Путь к файлу в кеше или None, если ресурс недоступен
+        """
+        with self.lock:
+            self._load_index()
+            entry = self.index.get(url)
+            cache_path = entry['path'] if entry else self._cache_path(url, filename)
+            has_copy = os.path.isfile(cache_path)
+
+            if url in self.validated:
+                return cache_path if has_copy else None
+            self.validated.add(url)
+
+            headers = {}
+            if entry and has_copy:
+                if entry.get('etag'):
+                    headers['If-None-Match'] = entry['etag']
+                if entry.get('last_modified'):
+                    headers['If-Modified-Since'] = entry['last_modified']
+
+            try:
+                rate_limiter.acquire(url)
+                self.requests += 1
+                response = self.session.get(url, headers=headers, timeout=config.REQUEST_TIMEOUT)
+                if response.status_code == 304 and has_copy:
+                    self.not_modified += 1
+                    return cache_path
+                response.raise_for_status()
+            except requests.RequestException:
+                # Сайт недоступен - используем то, что есть
+                return cache_path if has_copy else None
+
+            os.makedirs(self.root, exist_ok=True)
+            # Новая версия пишется в новый файл: старые ссылки в тредах не меняются
+            tmp_path = cache_path + '.tmp'
+            with open(tmp_path, 'wb') as f:
+                f.write(response.content)
+            os.replace(tmp_path, cache_path)
+
+            self.index[url] = {
+                'path': cache_path,
+                'etag': response.headers.get('ETag'),
+                'last_modified': response.headers.get('Last-Modified')
+            }
+            self._save_index()
+            return cache_path
+
+    def materialize(self, url: str, filename: str, dest_path: str) -> bool:
+        """
+        Подключить ресурс в папку треда
+
+        Returns:
+            True если файл ресурса есть в папке треда
+        """
+        cache_path = self.get(url, filename)
+        if cache_path is None:
+            return False
+        if os.path.exists(dest_path) and os.path.samefile(dest_path, cache_path):
+            return True
+        try:
+            link_file(cache_path, dest_path)
+            return True
+        except OSError:
+            return False
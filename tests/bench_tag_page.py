@@ -0,0 +1,103 @@
+"""
+Сравнение скорости разбора страницы тега: lxml против исходного разбора через BeautifulSoup
+
+Запуск:
+    python tests/bench_tag_page.py [страница.html ...]
+
+Без аргументов используются страницы из tests/fixtures/tag. Перед замером
+проверяется, что оба способа возвращают одинаковые треды и число страниц.
+"""
+
+import os
+import re
+import sys
+import time
+from typing import List, Tuple
+
+from bs4 import BeautifulSoup
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from parser import ArhivachParser, ThreadInfo  # noqa: E402
+
+
+FIXTURES_DIR = os.path.join(os.path.dirname(__file__), 'fixtures', 'tag')
+
+# Повторов на страницу; берётся лучшее время
+ROUNDS = 200
+
+
+def parse_tag_page_reference(parser: ArhivachParser, content: bytes, tag_id: int) -> Tuple[List[ThreadInfo], int]:
+    """Исходный разбор страницы тега (get_threads_from_tag_page до перехода на lxml)"""
+    soup = BeautifulSoup(content, 'lxml')
+    threads = []
+
+    thread_table = soup.find('table', class_='thread_list') or soup.find('table')
+    if thread_table:
+        for row in thread_table.find_all('tr'):
+            if row.find('th'):
+                continue
+            cells = row.find_all('td')
+            if len(cells) >= 2:
+                link = row.find('a', href=re.compile(r'/thread/\d+'))
+                if link:
+                    thread_url = parser._normalize_url(link.get('href', ''))
+                    threads.append(ThreadInfo(
+                        url=thread_url,
+                        title=link.get_text(strip=True)[:100],
+                        date=cells[-1].get_text(strip=True),
+                        thread_id=parser._extract_thread_id(thread_url)
+                    ))
+
+    total_pages = 1
+    for link in soup.find_all('a', href=True):
+        href = link.get('href', '')
+        if f'tags={tag_id}' in href:
+            offset_match = re.search(r'/index/(\d+)/\?', href)
+            if offset_match:
+                total_pages = max(total_pages, int(offset_match.group(1)) // 25 + 1)
+            link_text = link.get_text(strip=True)
+            if link_text.isdigit():
+                total_pages = max(total_pages, int(link_text))
+
+    return threads, total_pages
+
+
+def best_time(func, *args) -> float:
+    best = float('inf')
+    for _ in range(ROUNDS):
+        started = time.perf_counter()
+        func(*args)
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def main():
+    paths = sys.argv[1:] or sorted(
+        os.path.join(FIXTURES_DIR, name) for name in os.listdir(FIXTURES_DIR) if name.endswith('.html')
+    )
+    parser = ArhivachParser('https://arhivach.vc')
+
+    for path in paths:
+        with open(path, 'rb') as f:
+            content = f.read()
+        match = re.search(r'(\d+)', os.path.basename(path))
+        tag_id = int(match.group(1)) if match else 0
+
+        reference = parse_tag_page_reference(parser, content, tag_id)
+        threads, total_pages = parser.parse_tag_page_html(content, tag_id)
+        # posts_count исходный разбор не заполнял - сравниваем остальные поля
+        same = (total_pages == reference[1]
+                and [(t.url, t.title, t.date, t.thread_id) for t in threads]
+                == [(t.url, t.title, t.date, t.thread_id) for t in reference[0]])
+
+        old = best_time(parse_tag_page_reference, parser, content, tag_id)
+        new = best_time(parser.parse_tag_page_html, content, tag_id)
+        print(f"{os.path.basename(path)}: тредов {len(threads)}, страниц {total_pages}, "
+              f"результат {'совпадает' if same else 'ОТЛИЧАЕТСЯ'}")
+        print(f"  BeautifulSoup: {old * 1000:.2f} мс, lxml: {new * 1000:.2f} мс, "
+              f"быстрее в {old / new:.1f} раза")
+
+
+if __name__ == '__main__':
+    main()
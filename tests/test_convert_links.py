@@ -0,0 +1,86 @@
+"""
+Ссылки на медиа, сконвертированные в JPG командой --convert
+
+После конвертации повторный обход при выключенной конвертации не должен
+возвращать в thread.html и posts.jsonl ссылки на удалённые PNG, а уже
+испорченные ссылки чинит следующий запуск --convert.
+"""
+
+import os
+import json
+import shutil
+import tempfile
+import unittest
+
+import config
+from mediaconvert import MediaConverter
+from parser import ArhivachParser, MediaFile, MediaManifest, Post, ThreadPage
+from pipeline import MEDIA_MANIFEST_NAME, POSTS_FILE_NAME, save_thread_page
+
+HTML = '<a href="media/abc.png"><img src="media/abc_thumb.jpg"></a><a href="media/abc.png.txt"></a>'
+
+
+class ConvertedLinksTest(unittest.TestCase):
+
+    def setUp(self):
+        self.saved_config = (config.CONVERT_IMAGES_TO_JPG, config.MEDIA_STORE_ENABLED)
+        config.CONVERT_IMAGES_TO_JPG = False
+        config.MEDIA_STORE_ENABLED = False
+        self.base_dir = tempfile.mkdtemp()
+        self.parser = ArhivachParser('https://arhivach.vc')
+        self.page = ThreadPage(
+            url='https://arhivach.vc/thread/100/',
+            html_content=HTML,
+            media_files=MediaManifest([
+                MediaFile('https://arhivach.vc/storage/abc.png', 'abc.png', 'image'),
+                MediaFile('https://arhivach.vc/storage/abc_thumb.jpg', 'abc_thumb.jpg', 'image'),
+            ]),
+            thread_date='01.02.25',
+            thread_id='100',
+            posts=[Post(number='100', attachments=['media/abc.png'])],
+        )
+        self.thread_dir = os.path.join(self.base_dir, self.parser.get_folder_name('01.02.25', '100'))
+        self.media_dir = os.path.join(self.thread_dir, 'media')
+        os.makedirs(self.media_dir)
+        # Состояние после --convert: оригинала нет, рядом лежит JPG
+        for name in ('abc.jpg', 'abc_thumb.jpg'):
+            with open(os.path.join(self.media_dir, name), 'wb') as f:
+                f.write(b'\xff\xd8\xff')
+
+    def tearDown(self):
+        config.CONVERT_IMAGES_TO_JPG, config.MEDIA_STORE_ENABLED = self.saved_config
+        shutil.rmtree(self.base_dir)
+
+    def read_links(self):
+        with open(os.path.join(self.thread_dir, 'thread.html'), 'r', encoding='utf-8') as f:
+            html = f.read()
+        with open(os.path.join(self.thread_dir, POSTS_FILE_NAME), 'r', encoding='utf-8') as f:
+            attachments = [json.loads(line)['attachments'] for line in f if line.strip()]
+        return html, attachments
+
+    def test_recrawl_links_converted_files(self):
+        save_thread_page(self.parser, self.page, self.base_dir)
+        html, attachments = self.read_links()
+        self.assertIn('media/abc.jpg"', html)
+        self.assertNotIn('media/abc.png"', html)
+        self.assertIn('media/abc.png.txt"', html)
+        self.assertEqual(attachments, [['media/abc.jpg']])
+
+    def test_convert_repairs_broken_links(self):
+        # Страница, записанная до исправления: ссылка на удалённый PNG
+        with open(os.path.join(self.thread_dir, 'thread.html'), 'w', encoding='utf-8') as f:
+            f.write(HTML)
+        with open(os.path.join(self.thread_dir, POSTS_FILE_NAME), 'w', encoding='utf-8') as f:
+            f.write(json.dumps({'number': '100', 'attachments': ['media/abc.png']}) + '\n')
+        self.page.media_files.save(os.path.join(self.thread_dir, MEDIA_MANIFEST_NAME))
+
+        stats = MediaConverter(workers=1).run(self.base_dir)
+        html, attachments = self.read_links()
+        self.assertEqual(stats.updated_pages, 1)
+        self.assertIn('media/abc.jpg"', html)
+        self.assertNotIn('media/abc.png"', html)
+        self.assertEqual(attachments, [['media/abc.jpg']])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+"""
+Совпадение результатов бэкендов разбора треда (bs4 и lxml)
+
+Страницы из tests/fixtures разбираются обоими бэкендами; списки медиа,
+ресурсов и постов, дата треда и дерево HTML должны совпадать.
+"""
+
+import os
+import unittest
+
+import lxml.html
+
+import config
+from parser import LXML_HTML_PARSER, ArhivachParser
+
+
+FIXTURES_DIR = os.path.join(os.path.dirname(__file__), 'fixtures')
+
+THREAD_URL = 'https://arhivach.vc/thread/1122323/'
+
+
+def _html_tree(html: str) -> list:
+    """Дерево HTML без различий формата записи (<br> и <br/>, порядок атрибутов)"""
+    doc = lxml.html.document_fromstring(html.encode('utf-8'), parser=LXML_HTML_PARSER)
+    return [
+        (str(el.tag), sorted(el.attrib.items()), (el.text or '').strip(), (el.tail or '').strip())
+        for el in doc.iter()
+    ]
+
+
+class ParserBackendParityTest(unittest.TestCase):
+
+    def setUp(self):
+        self.saved = (config.PARSER_BACKEND, config.PARSE_CACHE_ENABLED)
+        # Результат должен получаться разбором, а не из кэша
+        config.PARSE_CACHE_ENABLED = False
+        self.parser = ArhivachParser('https://arhivach.vc')
+
+    def tearDown(self):
+        config.PARSER_BACKEND, config.PARSE_CACHE_ENABLED = self.saved
+
+    def _parse(self, content: bytes, backend: str):
+        config.PARSER_BACKEND = backend
+        return self.parser.parse_thread_html(content, THREAD_URL)
+
+    def test_fixtures(self):
+        names = sorted(name for name in os.listdir(FIXTURES_DIR) if name.endswith('.html'))
+        self.assertTrue(names)
+        for name in names:
+            with self.subTest(fixture=name):
+                with open(os.path.join(FIXTURES_DIR, name), 'rb') as f:
+                    content = f.read()
+                soup_page = self._parse(content, 'bs4')
+                lxml_page = self._parse(content, 'lxml')
+
+                self.assertTrue(soup_page.media_files)
+                self.assertEqual(list(soup_page.media_files), list(lxml_page.media_files))
+                self.assertEqual(soup_page.resource_files, lxml_page.resource_files)
+                self.assertEqual(soup_page.posts, lxml_page.posts)
+                self.assertEqual(soup_page.thread_date, lxml_page.thread_date)
+                self.assertEqual(soup_page.thread_id, lxml_page.thread_id)
+                self.assertEqual(soup_page.posts_count, lxml_page.posts_count)
+                self.assertEqual(_html_tree(soup_page.html_content), _html_tree(lxml_page.html_content))
+
+
+if __name__ == '__main__':
+    unittest.main()
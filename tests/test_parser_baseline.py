@@ -0,0 +1,54 @@
+"""
+Совпадение разбора треда (бэкенд bs4) с исходной реализацией
+
+Для каждой страницы из tests/fixtures в tests/baseline сохранён результат
+parse_thread до перехода на разбор за один обход дерева. HTML должен
+совпадать побайтно, списки медиа и ресурсов - полностью.
+"""
+
+import os
+import json
+import unittest
+from dataclasses import asdict
+
+import config
+from parser import ArhivachParser
+
+
+TESTS_DIR = os.path.dirname(__file__)
+FIXTURES_DIR = os.path.join(TESTS_DIR, 'fixtures')
+BASELINE_DIR = os.path.join(TESTS_DIR, 'baseline')
+
+THREAD_URL = 'https://arhivach.vc/thread/1122323/'
+
+
+class ParserBaselineTest(unittest.TestCase):
+
+    def setUp(self):
+        self.saved = (config.PARSER_BACKEND, config.PARSE_CACHE_ENABLED)
+        config.PARSER_BACKEND = 'bs4'
+        config.PARSE_CACHE_ENABLED = False
+        self.parser = ArhivachParser('https://arhivach.vc')
+
+    def tearDown(self):
+        config.PARSER_BACKEND, config.PARSE_CACHE_ENABLED = self.saved
+
+    def test_fixtures(self):
+        names = sorted(name for name in os.listdir(BASELINE_DIR) if name.endswith('.json'))
+        self.assertTrue(names)
+        for name in names:
+            with self.subTest(fixture=name):
+                with open(os.path.join(BASELINE_DIR, name), 'r', encoding='utf-8') as f:
+                    expected = json.load(f)
+                with open(os.path.join(FIXTURES_DIR, name[:-5] + '.html'), 'rb') as f:
+                    page = self.parser.parse_thread_html(f.read(), THREAD_URL)
+
+                self.assertEqual(page.html_content, expected['html_content'])
+                self.assertEqual([asdict(m) for m in page.media_files], expected['media_files'])
+                self.assertEqual([asdict(r) for r in page.resource_files], expected['resource_files'])
+                self.assertEqual(page.thread_date, expected['thread_date'])
+                self.assertEqual(page.thread_id, expected['thread_id'])
+
+
+if __name__ == '__main__':
+    unittest.main()
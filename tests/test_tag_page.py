@@ -0,0 +1,36 @@
+"""
+Разбор сохранённой страницы тега
+
+Результат сверяется с исходным разбором через BeautifulSoup
+(tests/bench_tag_page.py), количество постов - с колонкой таблицы.
+"""
+
+import os
+import unittest
+
+from parser import ArhivachParser
+from tests.bench_tag_page import FIXTURES_DIR, parse_tag_page_reference
+
+
+class TagPageTest(unittest.TestCase):
+
+    def setUp(self):
+        self.parser = ArhivachParser('https://arhivach.vc')
+        with open(os.path.join(FIXTURES_DIR, 'tag_14905.html'), 'rb') as f:
+            self.content = f.read()
+
+    def test_matches_reference(self):
+        threads, total_pages = self.parser.parse_tag_page_html(self.content, 14905)
+        reference, reference_pages = parse_tag_page_reference(self.parser, self.content, 14905)
+        self.assertEqual(total_pages, reference_pages)
+        self.assertEqual([(t.url, t.title, t.date, t.thread_id) for t in threads],
+                         [(t.url, t.title, t.date, t.thread_id) for t in reference])
+
+    def test_posts_count(self):
+        threads, total_pages = self.parser.parse_tag_page_html(self.content, 14905)
+        self.assertEqual(total_pages, 60)
+        self.assertEqual([t.posts_count for t in threads], [150 + i * 7 for i in range(25)])
+
+
+if __name__ == '__main__':
+    unittest.main()